@@ -0,0 +1,125 @@
+"""
+Batched, streaming inference over the SSP scenarios.
+
+All scenarios are read from the store in a single pass of fixed-size chunks and scored with a
+persisted model and scaler. The predictions of each scenario are written straight to its own
+Parquet file while its summary statistics are updated incrementally, so memory stays flat
+whatever the size of the data.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_config import DataConfig
+from data_store import dataset_columns, dataset_exists, iter_dataset
+
+
+class ScoringSummary:
+    """
+    Summary statistics of a scenario's predictions, updated one chunk at a time:
+    the class distribution, the mean risk, and the mean risk per grid cell and year.
+    Non-numeric predictions count as a risk of 1 when equal to `positive_label`.
+    """
+
+    def __init__(self, positive_label=None):
+        self.positive_label = positive_label
+        self.class_counts = pd.Series(dtype="int64")
+        self.n_samples = 0
+        self.risk_sum = 0.0
+        self._cells = None
+
+    def _risk(self, predictions):
+        if pd.api.types.is_numeric_dtype(predictions):
+            return predictions.astype("float64")
+        return (predictions == self.positive_label).astype("float64")
+
+    def update(self, chunk, predictions):
+        predictions = pd.Series(predictions, index=chunk.index)
+        self.class_counts = self.class_counts.add(predictions.value_counts(), fill_value=0).astype("int64")
+
+        risk = self._risk(predictions)
+        self.n_samples += len(risk)
+        self.risk_sum += risk.sum()
+
+        cells = risk.groupby([chunk["latitude"], chunk["longitude"], chunk["time"].dt.year.rename("year")])
+        cells = cells.agg(["sum", "count"])
+        self._cells = cells if self._cells is None else self._cells.add(cells, fill_value=0)
+
+    def class_distribution(self):
+        """Share of each predicted class, like `value_counts(normalize=True)`."""
+        return (self.class_counts / self.class_counts.sum()).sort_values(ascending=False)
+
+    def mean_risk(self):
+        return self.risk_sum / self.n_samples if self.n_samples else np.nan
+
+    def risk_per_cell_and_year(self):
+        """Mean risk and number of samples per (latitude, longitude, year)."""
+        if self._cells is None:
+            return pd.DataFrame(columns=["latitude", "longitude", "year", "mean_risk", "count"])
+        cells = self._cells.sort_index()
+        return pd.DataFrame({
+            "mean_risk": cells["sum"] / cells["count"],
+            "count": cells["count"].astype("int64"),
+        }).reset_index()
+
+
+def iter_scenarios(scenarios, chunk_rows=None):
+    """
+    Chunks of the `projections` dataset of several scenarios, with their `scenario` column,
+    read in one pass over the store. Falls back to the legacy CSV export of each scenario.
+
+    - `scenarios`: mapping of scenario name to its legacy CSV export (or None).
+    """
+    chunk_rows = chunk_rows or DataConfig.SCORING_CHUNK_ROWS
+    if dataset_exists("projections"):
+        columns = dataset_columns("projections") + ["scenario"]
+        yield from iter_dataset("projections", columns=columns, scenario=list(scenarios), batch_rows=chunk_rows)
+        return
+    for scenario, csv_file in scenarios.items():
+        for chunk in iter_dataset("projections", csv_file=csv_file, batch_rows=chunk_rows):
+            yield chunk.assign(scenario=scenario)
+
+
+def score_scenarios(model, scaler, scenarios, features, output_template, prepare=None,
+                    prediction_column="predicted_target", positive_label=None, chunk_rows=None):
+    """
+    Score several scenarios of the `projections` dataset in a single pass, chunk by chunk.
+    Every chunk is transformed and predicted at once, whichever scenarios its rows belong to,
+    then split by scenario to update that scenario's summary and predictions file.
+
+    - `scenarios`: mapping of scenario name to its legacy CSV export (or None).
+    - `output_template`: path of the Parquet predictions, formatted with the scenario name.
+    - `prepare`: optional function deriving the feature columns from a raw chunk.
+
+    Returns a dict of `ScoringSummary` per scenario, in the order of `scenarios`.
+    """
+    summaries = {scenario: ScoringSummary(positive_label) for scenario in scenarios}
+    writers = {}
+    try:
+        for chunk in iter_scenarios(scenarios, chunk_rows):
+            if prepare is not None:
+                chunk = prepare(chunk)
+            chunk[prediction_column] = model.predict(scaler.transform(chunk[features]))
+
+            for scenario, rows in chunk.groupby("scenario", observed=True, sort=False):
+                rows = rows.drop(columns="scenario")
+                summaries[scenario].update(rows, rows[prediction_column])
+
+                table = pa.Table.from_pandas(rows, preserve_index=False)
+                if scenario not in writers:
+                    output_file = Path(str(output_template).format(scenario=scenario))
+                    output_file.parent.mkdir(parents=True, exist_ok=True)
+                    writers[scenario] = pq.ParquetWriter(output_file, table.schema)
+                writers[scenario].write_table(table)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return summaries
+
+
+def score_scenario(model, scaler, scenario, features, output_file, csv_file=None, **kwargs):
+    """Score a single scenario with `score_scenarios`. Returns its `ScoringSummary`."""
+    return score_scenarios(model, scaler, {scenario: csv_file}, features, output_file, **kwargs)[scenario]
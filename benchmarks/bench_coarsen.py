@@ -0,0 +1,72 @@
+"""
+Compare the pandas groupby coarsening (`easier_coordinates`) with the gridded one (`coarsen_grid`)
+on a synthetic 0.1° European grid. Both give the compact dtypes of the store, as `coarsen` does.
+
+Usage:
+    python benchmarks/bench_coarsen.py [--months 12] [--resolution 0.1]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from data_proprocessing import GRID_KEYS, coarsen_grid, easier_coordinates  # noqa: E402
+from data_store import to_store_schema  # noqa: E402
+
+
+def synthetic_dataset(months, resolution, seed=0):
+    """Monthly dataset on a regular grid over the Europe box, with some missing values."""
+    rng = np.random.default_rng(seed)
+    latitudes = np.arange(35, 71, resolution) + resolution / 2
+    longitudes = np.arange(-25, 45, resolution) + resolution / 2
+    times = pd.date_range("2000-01-01", periods=months, freq="MS") + pd.Timedelta(days=14)
+    values = rng.random((months, latitudes.size, longitudes.size)).astype("float32")
+    values[values < 0.05] = np.nan
+    return xr.Dataset(
+        {"value": (GRID_KEYS, values)},
+        coords={"time": times, "latitude": latitudes, "longitude": longitudes},
+    )
+
+
+def pandas_coarsening(dataset):
+    dataframe = dataset.to_dataframe().reset_index()
+    return to_store_schema(easier_coordinates(dataframe.dropna()))
+
+
+def gridded_coarsening(dataset):
+    return coarsen_grid(dataset, ["value"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--resolution", type=float, default=0.1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    dataset = synthetic_dataset(args.months, args.resolution)
+    n_points = dataset["value"].size
+    print(f"{n_points} grid points ({args.months} months at {args.resolution}°)")
+
+    results = {}
+    for name, function in [("pandas", pandas_coarsening), ("xarray", gridded_coarsening)]:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results[name] = function(dataset)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print(f"{name:>8}: {best:.3f}s  ({n_points / best / 1e6:.1f} M points/s)")
+
+    pd.testing.assert_frame_equal(results["pandas"], results["xarray"], rtol=1e-5)
+    print("Both engines give the same coarsened grid.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Compare submissions on the folds of `problem.get_cv`: fit time, predict throughput,
+size of the fitted pipeline and accuracy.
+
+Each submission's pipeline is fitted on the training part of every fold and predicts its test
+part, one fold after the other so that the timings are not disturbed. Predictions go through
+the RAMP workflow, as `ramp-test` makes them: class probabilities for classifiers, checked
+against the prediction type of the problem. The size is that of the pickled fitted pipeline.
+`--n-threads` is passed to the steps that take an `n_threads` parameter.
+
+Usage:
+    python benchmarks/bench_estimators.py [--submissions base binned_hgb] [--path .]
+                                          [--n-threads 4] [--output results.json]
+"""
+import argparse
+import json
+import pickle
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import problem  # noqa: E402
+from cv_runner import load_submission, take_rows  # noqa: E402
+
+
+def set_threads(estimator, n_threads):
+    """Set `n_threads` on every step of a pipeline that has the parameter."""
+    params = {name: n_threads for name in estimator.get_params() if name.split("__")[-1] == "n_threads"}
+    return estimator.set_params(**params)
+
+
+def run(submissions, path=".", n_threads=None):
+    """Fit and score every submission on every fold. Returns one result per (submission, fold)."""
+    X, y = problem.get_train_data(path)
+    folds = list(problem.get_cv(X, y))
+
+    results = []
+    for submission in submissions:
+        module = load_submission(submission, path)
+        for fold, (train_index, test_index) in enumerate(folds):
+            X_train, y_train = take_rows(X, train_index), take_rows(y, train_index)
+            X_test, y_test = take_rows(X, test_index), take_rows(y, test_index)
+            estimator = set_threads(module.get_estimator(), n_threads)
+
+            start = time.perf_counter()
+            estimator.fit(X_train, y_train)
+            fit_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            y_proba = problem.workflow.test_submission(estimator, X_test)
+            predict_s = time.perf_counter() - start
+            labels = np.asarray(problem.Predictions.label_names)
+            y_pred = labels[problem.Predictions(y_pred=y_proba).y_pred_label_index]
+
+            results.append({
+                "submission": submission,
+                "fold": fold,
+                "fit_s": fit_s,
+                "predict_rows_per_s": len(X_test) / predict_s,
+                "size_mb": len(pickle.dumps(estimator)) / 1024 ** 2,
+                "accuracy": accuracy_score(y_test, y_pred),
+            })
+            print(f"{submission:>12} fold {fold}: fit {fit_s:7.2f}s, predict {len(X_test) / predict_s:>12,.0f} rows/s, "
+                  f"{results[-1]['size_mb']:8.2f} MB, accuracy {results[-1]['accuracy']:.4f}", flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--submissions", nargs="+", default=["base", "binned_hgb"])
+    parser.add_argument("--path", default=str(ROOT), help="Root of the kit, holding data/ and submissions/.")
+    parser.add_argument("--n-threads", type=int, default=None, help="Threads of the estimators taking n_threads.")
+    parser.add_argument("--output", help="Write the results of every fold to this JSON file.")
+    args = parser.parse_args()
+
+    results = run(args.submissions, args.path, args.n_threads)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+    summary = pd.DataFrame(results).groupby("submission", sort=False).agg(
+        fit_s=("fit_s", "mean"),
+        predict_rows_per_s=("predict_rows_per_s", "mean"),
+        size_mb=("size_mb", "mean"),
+        accuracy=("accuracy", "mean"),
+        accuracy_std=("accuracy", "std"),
+    )
+    print(summary.to_string(float_format=lambda value: f"{value:,.4f}"))
+
+
+if __name__ == "__main__":
+    main()
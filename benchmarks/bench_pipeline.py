@@ -0,0 +1,174 @@
+"""
+Throughput and peak memory of the data pipeline stages on synthetic fixtures (see fixtures.py),
+at several scales, so that regressions of the loaders and transforms can be caught offline.
+
+For every number of years given, fixtures are written to a temporary directory and each stage
+is timed (best of `--repeat` runs, build cache disabled), then run once more under tracemalloc
+for its peak of traced allocations. The results can be saved as JSON and compared with a
+previous run: the script exits with status 1 when a stage got slower than `--tolerance`
+times its baseline, unless `--warn-only` is given (timings on shared CI runners are too noisy
+to gate on).
+
+Usage:
+    python benchmarks/bench_pipeline.py [--years 1 2 4] [--resolution 0.25] [--output results.json]
+                                        [--baseline baseline.json] [--tolerance 1.5] [--warn-only]
+"""
+import argparse
+import io
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import data_proprocessing as dp  # noqa: E402
+from cv_runner import load_submission  # noqa: E402
+from data_config import DataConfig  # noqa: E402
+from fixtures import configure, make_fixtures  # noqa: E402
+from profiling import PROFILER  # noqa: E402
+
+# Slowdowns shorter than this are timer noise rather than regressions
+MIN_REGRESSION_S = 0.05
+
+
+def raw_precipitation_frame(variable, variable_name):
+    """Ungridded dataframe of one precipitation variable over the period, as given to `easier_coordinates`."""
+    frames = []
+    with dp.ZipMemberReader(DataConfig.DATA_PATH / "precipitation.zip") as reader:
+        for year in DataConfig.HISTORICAL_PERIOD:
+            with reader.open_dataset(dp.precipitation_file_name(variable_name, year)) as dataset:
+                dataset = dataset.rename({list(dataset.data_vars)[0]: variable})
+                frames.append(dataset.to_dataframe().reset_index().dropna())
+    return pd.concat(frames, ignore_index=True)
+
+
+def zip_mb(pattern):
+    return sum(path.stat().st_size for path in DataConfig.DATA_PATH.glob(pattern)) / 1024 ** 2
+
+
+def cases():
+    """
+    (name, input size, input unit, function, arguments factory) of each benchmarked stage.
+    The factory gives fresh arguments to every run, as some stages modify their input.
+    """
+    variable, variable_name = next(iter(DataConfig.EXTREME_PRECIPITATION_VARIABLES.items()))
+    raw_precipitation = raw_precipitation_frame(variable, variable_name)
+    precipitation_df = dp.load_precipitation_data()
+    historical_df = dp.load_projection_data("historical")
+    preprocessor = load_submission("base", ROOT).Preprocessor().fit(historical_df)
+
+    return [
+        ("load_precipitation_data", zip_mb("precipitation.zip"), "MB",
+         dp.load_precipitation_data, lambda: ()),
+        ("load_projection_data", zip_mb("historical_*.zip"), "MB",
+         dp.load_projection_data, lambda: ("historical",)),
+        ("load_flood_risk_data", zip_mb("flood_risk_*.zip"), "MB",
+         dp.load_flood_risk_data, lambda: ()),
+        ("easier_coordinates", len(raw_precipitation), "rows",
+         dp.easier_coordinates, lambda: (raw_precipitation.copy(),)),
+        ("create_categorical_variable", len(precipitation_df), "rows",
+         dp.create_categorical_variable, lambda: (precipitation_df,)),
+        ("Preprocessor.transform", len(historical_df), "rows",
+         preprocessor.transform, lambda: (historical_df,)),
+    ]
+
+
+def measure(function, make_args, repeat):
+    """(best wall time in seconds, peak traced memory in MB, rows out) of a stage."""
+    best = float("inf")
+    for _ in range(repeat):
+        args = make_args()
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+        del args
+
+    args = make_args()
+    tracemalloc.start()
+    try:
+        function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak / 1024 ** 2, len(result)
+
+
+def run(years, resolution, repeat):
+    """Benchmark every stage at each number of years. Returns one result per (years, stage)."""
+    results = []
+    for n_years in years:
+        with tempfile.TemporaryDirectory() as directory:
+            configure(directory, make_fixtures(directory, n_years, resolution))
+            # Keep the progress messages of the loaders out of the report
+            with redirect_stdout(io.StringIO()):
+                stages = cases()
+            for name, size, unit, function, make_args in stages:
+                with redirect_stdout(io.StringIO()):
+                    seconds, peak_mb, rows_out = measure(function, make_args, repeat)
+                results.append({
+                    "stage": name,
+                    "years": n_years,
+                    "resolution": resolution,
+                    "input": size,
+                    "unit": unit,
+                    "seconds": seconds,
+                    "throughput": size / seconds,
+                    "peak_mb": peak_mb,
+                    "rows_out": rows_out,
+                })
+                print(f"{name:>28} {n_years:>3} yr: {seconds:8.3f}s {size / seconds:>14,.1f} {unit}/s "
+                      f"peak {peak_mb:8.1f} MB, {rows_out:,} rows out", flush=True)
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    """Stages of `results` slower than `tolerance` times the same stage and scale in `baseline`."""
+    previous = {(r["stage"], r["years"], r["resolution"]): r["seconds"] for r in baseline}
+    slower = []
+    for result in results:
+        key = (result["stage"], result["years"], result["resolution"])
+        if key in previous and result["seconds"] > max(tolerance * previous[key], previous[key] + MIN_REGRESSION_S):
+            slower.append((key, previous[key], result["seconds"]))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 2, 4], help="Scales, in years of data.")
+    parser.add_argument("--resolution", type=float, default=0.25, help="Grid spacing of the E-OBS and GloFAS fixtures.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with.")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Slowdown over the baseline that fails the run.")
+    parser.add_argument("--warn-only", action="store_true", help="Report the regressions without failing the run.")
+    args = parser.parse_args()
+
+    DataConfig.USE_BUILD_CACHE = False
+    DataConfig.EXECUTOR = "serial"
+    PROFILER.print_depth = None
+
+    results = run(args.years, args.resolution, args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline and Path(args.baseline).exists():
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        for (name, years, _), before, after in slower:
+            print(f"Regression: {name} on {years} year(s) took {after:.3f}s, {before:.3f}s in the baseline.")
+        if slower and not args.warn_only:
+            sys.exit(1)
+        if not slower:
+            print(f"No stage slower than {args.tolerance}x the baseline.")
+
+
+if __name__ == "__main__":
+    main()
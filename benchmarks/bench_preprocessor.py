@@ -0,0 +1,86 @@
+"""
+Compare the throughput of the base submission's Preprocessor with the previous
+row-by-row implementation.
+
+Usage:
+    python benchmarks/bench_preprocessor.py [--rows 200000]
+"""
+import argparse
+import importlib.util
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def load_base_preprocessor():
+    spec = importlib.util.spec_from_file_location("base_estimator", ROOT / "submissions" / "base" / "estimator.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Preprocessor
+
+
+def legacy_transform(X):
+    """Row-by-row transform of the base submission before vectorization (batch statistics)."""
+    features = []
+    for i in X.index:
+        lat, lon = X.loc[i, 'latitude'], X.loc[i, 'longitude']
+        precipitation = X.loc[i, 'precipitation']
+        air_temp = X.loc[i, 'air_temperature']
+        features.append(np.concatenate([[lat], [lon], [precipitation], [air_temp]]))
+
+    df = pd.DataFrame(np.array(features), columns=['lat', 'lon', 'precipitation', 'air_temperature'])
+    for column in df.columns:
+        df[column] = (df[column] - df[column].mean()) / df[column].std()
+    return df.astype(float)
+
+
+def synthetic_features(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "latitude": rng.integers(35, 72, rows).astype("float64"),
+        "longitude": rng.integers(-25, 46, rows).astype("float64"),
+        "precipitation": rng.gamma(2.0, 1e-5, rows).astype("float32"),
+        "air_temperature": rng.normal(240, 5, rows).astype("float32"),
+    })
+
+
+def rows_per_second(function, X, repeat):
+    best = min(_timed(function, X) for _ in range(repeat))
+    return len(X) / best
+
+
+def _timed(function, X):
+    start = time.perf_counter()
+    function(X)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--legacy-rows", type=int, default=20_000,
+                        help="Rows given to the row-by-row implementation, which is much slower.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    X = synthetic_features(args.rows)
+    preprocessor = load_base_preprocessor()().fit(X)
+
+    vectorized = rows_per_second(preprocessor.transform, X, args.repeat)
+    legacy = rows_per_second(legacy_transform, X.iloc[:args.legacy_rows], 1)
+    print(f"{'legacy':>10}: {legacy:>14,.0f} rows/s")
+    print(f"{'vectorized':>10}: {vectorized:>14,.0f} rows/s  ({vectorized / legacy:.0f}x)")
+
+    # On a single batch both implementations standardize with the same statistics
+    sample = X.iloc[:args.legacy_rows]
+    expected = legacy_transform(sample).to_numpy()
+    np.testing.assert_allclose(load_base_preprocessor()().fit(sample).transform(sample), expected, rtol=1e-4, atol=1e-5)
+    print("Both implementations agree when fitted on the transformed batch.")
+
+
+if __name__ == "__main__":
+    main()
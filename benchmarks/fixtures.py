@@ -0,0 +1,169 @@
+"""
+Synthetic but format-faithful fixtures of the raw Copernicus datasets, to run the loaders offline.
+
+Writes, for a configurable number of years and grid resolution:
+- `precipitation.zip`: one E-OBS style NetCDF member per indicator and year, named like
+  `max-1day-precipitation_europe_e-obs_monthly_{year}_v1.nc`, with mid-month times and NaN over the sea;
+- `{experiment}_{variable}_{model}.zip`: one CMIP6 style member with `lat`/`lon` coordinates,
+  time bounds and a provenance file, for every configured experiment, variable and model;
+- `flood_risk_{year}_{year}.zip`: one GloFAS style member per year with a `valid_time` axis,
+  descending latitudes and the four flood risk variables.
+
+The data periods of `DataConfig` are narrowed to the generated years by `configure`.
+
+Usage:
+    python benchmarks/fixtures.py OUTPUT_DIR [--years 2] [--resolution 0.25]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from data_config import DataConfig  # noqa: E402
+from data_proprocessing import precipitation_file_name  # noqa: E402
+
+# GloFAS variable short names, in the order of DataConfig.FLOOD_RISK_VARIABLES
+FLOOD_RISK_SHORT_NAMES = ["dis24", "rowe", "sd", "swi"]
+
+# CMIP6 variable short names
+PROJECTION_SHORT_NAMES = {
+    "precipitation": "pr",
+    "air_temperature": "tas",
+    "total_runoff": "mrro",
+    "snowfall_flux": "prsn",
+}
+
+# Configured periods, fixtures take their first years (`configure` narrows the configuration afterwards)
+PERIODS = (DataConfig.HISTORICAL_PERIOD, DataConfig.PROJECTIONS_PERIOD, DataConfig.FLOOD_DATA_PERIOD)
+
+
+def europe_axes(resolution, descending_latitudes=False):
+    """Cell-centre latitudes and longitudes of the configured Europe area."""
+    north, west, south, east = DataConfig.FLOOD_RISK_REQUEST["area"]
+    latitudes = np.arange(south, north, resolution) + resolution / 2
+    longitudes = np.arange(west, east, resolution) + resolution / 2
+    return (latitudes[::-1] if descending_latitudes else latitudes), longitudes
+
+
+def sea_mask(latitudes, longitudes):
+    """Rough sea mask (the Atlantic west of 10°W and the Mediterranean south of 38°N), for NaN cells."""
+    lat, lon = np.meshgrid(latitudes, longitudes, indexing="ij")
+    return (lon < -10) | ((lat < 38) & (lon > 0) & (lon < 35))
+
+
+def netcdf_bytes(dataset):
+    """Content of a dataset written as NetCDF4, as the CDS serves it."""
+    handle, path = tempfile.mkstemp(suffix=".nc")
+    os.close(handle)
+    try:
+        dataset.to_netcdf(path, engine="netcdf4")
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+def precipitation_member(variable_name, year, latitudes, longitudes, rng):
+    times = pd.date_range(f"{year}-01-01", periods=12, freq="MS") + pd.Timedelta(days=14)
+    values = rng.gamma(2.0, 10.0, (12, latitudes.size, longitudes.size)).astype("float32")
+    values[:, sea_mask(latitudes, longitudes)] = np.nan
+    return xr.Dataset(
+        {variable_name.replace("-", "_"): (("time", "latitude", "longitude"), values, {"units": "mm"})},
+        coords={"time": times, "latitude": latitudes, "longitude": longitudes},
+    )
+
+
+def projection_member(variable, years, rng, resolution=1.4):
+    north, west, south, east = DataConfig.FLOOD_RISK_REQUEST["area"]
+    latitudes = np.arange(south, north, resolution)
+    longitudes = np.arange(west, east, resolution)
+    times = pd.date_range(f"{years[0]}-01-01", periods=12 * len(years), freq="MS") + pd.Timedelta(days=15)
+    bounds = np.stack([times - pd.Timedelta(days=15), times + pd.Timedelta(days=15)], axis=1)
+    values = rng.random((times.size, latitudes.size, longitudes.size)).astype("float32")
+    if variable == "total_runoff":
+        # Runoff is only defined over land
+        values[:, sea_mask(latitudes, longitudes)] = np.nan
+    return xr.Dataset(
+        {
+            PROJECTION_SHORT_NAMES.get(variable, variable): (("time", "lat", "lon"), values),
+            "time_bnds": (("time", "bnds"), bounds),
+            "lat_bnds": (("lat", "bnds"), np.stack([latitudes - resolution / 2, latitudes + resolution / 2], axis=1)),
+            "lon_bnds": (("lon", "bnds"), np.stack([longitudes - resolution / 2, longitudes + resolution / 2], axis=1)),
+        },
+        coords={"time": times, "lat": latitudes, "lon": longitudes},
+    )
+
+
+def flood_risk_member(year, latitudes, longitudes, rng):
+    times = pd.date_range(f"{year}-01-01", periods=12, freq="MS")
+    shape = (12, latitudes.size, longitudes.size)
+    return xr.Dataset(
+        {name: (("valid_time", "latitude", "longitude"), rng.random(shape).astype("float32"))
+         for name in FLOOD_RISK_SHORT_NAMES},
+        coords={"valid_time": times, "latitude": latitudes, "longitude": longitudes},
+    )
+
+
+def make_fixtures(output_dir, years=2, resolution=0.25, seed=0):
+    """
+    Write the fixtures of `years` years of every period to `output_dir`.
+    Returns the (historical, projections, flood risk) lists of years written.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    historical_years, projection_years, flood_years = (period[:years] for period in PERIODS)
+
+    latitudes, longitudes = europe_axes(resolution)
+    with zipfile.ZipFile(output_dir / "precipitation.zip", "w") as z:
+        for variable_name in DataConfig.EXTREME_PRECIPITATION_VARIABLES.values():
+            for year in historical_years:
+                member = precipitation_member(variable_name, year, latitudes, longitudes, rng)
+                z.writestr(precipitation_file_name(variable_name, year), netcdf_bytes(member))
+
+    for experiment in DataConfig.PROJECTIONS_EXPERIMENTS:
+        experiment_years = historical_years if experiment == "historical" else projection_years
+        for variable in DataConfig.PROJECTIONS_VARIABLES:
+            for model in DataConfig.PROJECTIONS_MODELS:
+                member = projection_member(variable, experiment_years, rng)
+                with zipfile.ZipFile(output_dir / f"{experiment}_{variable}_{model}.zip", "w") as z:
+                    z.writestr(f"{PROJECTION_SHORT_NAMES.get(variable, variable)}_{model}_{experiment}.nc",
+                               netcdf_bytes(member))
+                    z.writestr("provenance.json", "{}")
+
+    latitudes, longitudes = europe_axes(resolution, descending_latitudes=True)
+    for year in flood_years:
+        with zipfile.ZipFile(output_dir / f"flood_risk_{year}_{year}.zip", "w") as z:
+            z.writestr("data_version_4_0.nc", netcdf_bytes(flood_risk_member(year, latitudes, longitudes, rng)))
+
+    return historical_years, projection_years, flood_years
+
+
+def configure(output_dir, periods):
+    """Point `DataConfig` at fixtures written by `make_fixtures`."""
+    DataConfig.DATA_PATH = Path(output_dir)
+    DataConfig.HISTORICAL_PERIOD, DataConfig.PROJECTIONS_PERIOD, DataConfig.FLOOD_DATA_PERIOD = periods
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output_dir")
+    parser.add_argument("--years", type=int, default=2)
+    parser.add_argument("--resolution", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    periods = make_fixtures(args.output_dir, args.years, args.resolution, args.seed)
+    print(f"Fixtures written to {args.output_dir} for years {periods[0][0]}-{periods[0][-1]}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Spatio-temporal blocked splits of the gridded datasets.
+
+Rows are grouped into blocks of one year by `tile_degrees` x `tile_degrees` degrees, and whole
+blocks are assigned to folds, so neighbouring cells and months do not end up on both sides of a
+split. The fold of a block is a seeded hash of its id: it needs no pairwise structure nor any
+state beyond the block id array, and a block gets the same fold whichever rows or chunks of the
+data it is computed from. Once rows are laid out in (fold, block) order with `layout_order`,
+every fold is a contiguous range of rows.
+"""
+import numpy as np
+from sklearn.model_selection import BaseCrossValidator
+
+from data_config import DataConfig
+from grid_index import GridIndex
+
+
+def block_ids(dataframe, tile_degrees=None, grid=None):
+    """(year, latitude tile, longitude tile) block id of every row, as an int64 array."""
+    tile_degrees = tile_degrees or DataConfig.BLOCK_TILE_DEGREES
+    grid = grid or GridIndex.from_config()
+    month, lat, lon = grid.positions(dataframe["time"], dataframe["latitude"], dataframe["longitude"])
+    n_lat_tiles = -(-grid.shape[1] // tile_degrees)
+    n_lon_tiles = -(-grid.shape[2] // tile_degrees)
+    return ((month // 12) * n_lat_tiles + lat // tile_degrees) * n_lon_tiles + lon // tile_degrees
+
+
+def _mix(values, seed):
+    """SplitMix64 hash of integers, uniformly spread over the uint64 range."""
+    with np.errstate(over="ignore"):
+        z = np.asarray(values).astype(np.uint64) + np.uint64((seed or 0) * 0x9E3779B97F4A7C15 % 2 ** 64)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def block_folds(blocks, n_splits, random_state=None):
+    """Fold of every block id, in [0, n_splits)."""
+    return (_mix(blocks, random_state) % np.uint64(n_splits)).astype(np.int64)
+
+
+class BlockedSplit(BaseCrossValidator):
+    """
+    Cross-validation over whole (year, tile) blocks.
+    The folds are read from `groups` when given (block ids), otherwise computed from the
+    time, latitude and longitude columns of X. When the rows are in `layout_order`, every
+    test set is a single contiguous range and every training set the two ranges around it.
+    """
+
+    def __init__(self, n_splits=5, tile_degrees=None, random_state=None):
+        self.n_splits = n_splits
+        self.tile_degrees = tile_degrees
+        self.random_state = random_state
+
+    def get_n_splits(self, X=None, y=None, groups=None):
+        return self.n_splits
+
+    def folds(self, X, groups=None):
+        """Fold of every row."""
+        blocks = block_ids(X, self.tile_degrees) if groups is None else np.asarray(groups)
+        return block_folds(blocks, self.n_splits, self.random_state)
+
+    def layout_order(self, X):
+        """Permutation sorting rows by (fold, block), so that each fold is a contiguous range."""
+        blocks = block_ids(X, self.tile_degrees)
+        return np.lexsort((blocks, block_folds(blocks, self.n_splits, self.random_state)))
+
+    def split(self, X, y=None, groups=None):
+        folds = self.folds(X, groups)
+        n_samples = len(folds)
+        if n_samples < 2 or np.all(folds[1:] >= folds[:-1]):
+            # Laid out by fold: ranges instead of a scan per fold
+            bounds = np.searchsorted(folds, np.arange(self.n_splits + 1))
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                yield np.r_[0:start, stop:n_samples], np.arange(start, stop)
+            return
+        for fold in range(self.n_splits):
+            test = folds == fold
+            yield np.flatnonzero(~test), np.flatnonzero(test)
+
+
+def default_cv():
+    """Splitter of `problem.get_cv`, also used to lay out the training set in the feature store."""
+    return BlockedSplit(DataConfig.CV_SPLITS, DataConfig.BLOCK_TILE_DEGREES, random_state=DataConfig.SPLIT_RANDOM_STATE)
+
+
+def blocked_train_test_split(dataframe, test_size=0.2, tile_degrees=None, random_state=None):
+    """
+    Blocked counterpart of `train_test_split`: about `test_size` of the (year, tile) blocks go
+    to the test set. The split of a block only depends on its id, so splitting a dataset
+    chunk by chunk gives the same result as splitting it at once.
+    """
+    blocks = block_ids(dataframe, tile_degrees)
+    draws = (_mix(blocks, random_state) >> np.uint64(11)).astype(np.float64) / 2 ** 53
+    test = draws < test_size
+    return dataframe[~test], dataframe[test]
@@ -0,0 +1,184 @@
+"""
+Incremental build cache for the processed datasets.
+
+Every unit of work of the loaders (one precipitation variable, one projection file,
+one flood risk year) is stored as a Parquet artifact keyed on a hash of its inputs:
+the content of the raw zip, the relevant configuration and the transformation version.
+Only units whose inputs changed are recomputed.
+
+Usage:
+    python build_cache.py list [--kind KIND]
+    python build_cache.py invalidate [--kind KIND] [--name PATTERN]
+    python build_cache.py clear
+"""
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from data_config import DataConfig
+
+
+def cache_path(root=None):
+    """Directory holding the build cache, `data/cache` by default."""
+    root = DataConfig.DATA_PATH if root is None else Path(root)
+    return root / "cache"
+
+
+class BuildCache:
+    """
+    Per-artifact cache of the loaders' intermediate dataframes.
+    Artifacts are grouped by kind (e.g. `flood_risk`, `projections/historical`) and name.
+    """
+
+    def __init__(self, root=None, enabled=None):
+        self.path = cache_path(root)
+        self.enabled = DataConfig.USE_BUILD_CACHE if enabled is None else enabled
+        self._index_file = self.path / "index.json"
+        self._hashes_file = self.path / "file_hashes.json"
+        self.index = self._read_json(self._index_file)
+        self._hashes = self._read_json(self._hashes_file)
+
+    @staticmethod
+    def _read_json(path):
+        if path.exists():
+            with open(path) as f:
+                return json.load(f)
+        return {}
+
+    @staticmethod
+    def _write_json(path, content):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(content, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def file_hash(self, file_path, chunk_size=1 << 20):
+        """
+        SHA-256 of a file's content. Hashes are memoized on (size, mtime) so that
+        unchanged multi-GB zips are not read again on every build.
+        Returns None when the cache is disabled, as nothing would be looked up.
+        """
+        if not self.enabled:
+            return None
+        file_path = Path(file_path)
+        stat = file_path.stat()
+        entry = self._hashes.get(str(file_path.resolve()))
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"]
+
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+
+        self._hashes[str(file_path.resolve())] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": digest.hexdigest(),
+        }
+        self._write_json(self._hashes_file, self._hashes)
+        return digest.hexdigest()
+
+    @staticmethod
+    def key(inputs):
+        """Hash of the JSON-serialisable description of an artifact's inputs."""
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _artifact_file(self, kind, name):
+        return self.path / kind / f"{name}.parquet"
+
+    def has(self, kind, name, inputs):
+        """Whether an up-to-date artifact is cached, without reading it."""
+        if not self.enabled:
+            return False
+        entry = self.index.get(f"{kind}/{name}")
+        return entry is not None and entry["key"] == self.key(inputs) and self._artifact_file(kind, name).exists()
+
+    def get(self, kind, name, inputs):
+        """Cached dataframe for an artifact, or None if missing or built from other inputs."""
+        if not self.has(kind, name, inputs):
+            return None
+        return pd.read_parquet(self._artifact_file(kind, name))
+
+    def put(self, kind, name, inputs, dataframe):
+        """Store the dataframe built for an artifact and record its inputs."""
+        if not self.enabled:
+            return
+        artifact_file = self._artifact_file(kind, name)
+        artifact_file.parent.mkdir(parents=True, exist_ok=True)
+        dataframe.to_parquet(artifact_file, index=False)
+        self.index[f"{kind}/{name}"] = {
+            "key": self.key(inputs),
+            "inputs": inputs,
+            "rows": len(dataframe),
+            "size": artifact_file.stat().st_size,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self._write_json(self._index_file, self.index)
+
+    def entries(self, kind=None, pattern="*"):
+        """Index entries matching a kind and an artifact name pattern."""
+        for artifact, entry in sorted(self.index.items()):
+            artifact_kind, name = artifact.rsplit("/", 1)
+            if kind is not None and artifact_kind != kind:
+                continue
+            if fnmatch.fnmatch(name, pattern):
+                yield artifact_kind, name, entry
+
+    def invalidate(self, kind=None, pattern="*"):
+        """Remove the matching artifacts so they get rebuilt on the next load. Returns their count."""
+        removed = list(self.entries(kind, pattern))
+        for artifact_kind, name, _ in removed:
+            self._artifact_file(artifact_kind, name).unlink(missing_ok=True)
+            del self.index[f"{artifact_kind}/{name}"]
+        self._write_json(self._index_file, self.index)
+        return len(removed)
+
+    def clear(self):
+        """Remove the whole cache, including the memoized file hashes."""
+        if self.path.exists():
+            shutil.rmtree(self.path)
+        self.index, self._hashes = {}, {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and invalidate the incremental build cache.")
+    parser.add_argument("--root", default=None, help="Data directory (defaults to DataConfig.DATA_PATH).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="List the cached artifacts.")
+    list_parser.add_argument("--kind", default=None)
+
+    invalidate_parser = subparsers.add_parser("invalidate", help="Remove artifacts so they get rebuilt.")
+    invalidate_parser.add_argument("--kind", default=None)
+    invalidate_parser.add_argument("--name", default="*", help="Artifact name pattern, e.g. 'total_runoff_*'.")
+
+    subparsers.add_parser("clear", help="Remove the whole cache.")
+    args = parser.parse_args()
+
+    cache = BuildCache(args.root, enabled=True)
+    if args.command == "list":
+        total_size = 0
+        for kind, name, entry in cache.entries(args.kind):
+            total_size += entry["size"]
+            print(f"{kind:<28} {name:<40} {entry['rows']:>10} rows {entry['size'] / 1024 ** 2:>8.2f} MB "
+                  f"{entry['created']}  {entry['key'][:12]}")
+        print(f"Total: {total_size / 1024 ** 2:.2f} MB in {cache.path}")
+    elif args.command == "invalidate":
+        removed = cache.invalidate(args.kind, args.name)
+        print(f"Invalidated {removed} artifact(s).")
+    elif args.command == "clear":
+        cache.clear()
+        print(f"Cleared {cache.path}.")
+
+
+if __name__ == "__main__":
+    main()
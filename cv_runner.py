@@ -0,0 +1,224 @@
+"""
+Fold-parallel cross-validation of the RAMP submissions.
+
+The folds of `problem.get_cv` are computed once and saved to `data/folds`, so every run and
+every submission is scored on the same splits. Folds are trained in parallel worker processes,
+which each map the training data from the feature store rather than receiving a copy of it.
+The preprocessing steps of a submission's pipeline (all steps but the last) are fitted once
+per fold and cached in `data/cache/cv`, keyed on the submission's source files, the parameters
+of the steps, the data and the fold, so re-scoring a submission whose code did not change only
+refits its model.
+
+Usage:
+    python cv_runner.py [--submission base] [--n-jobs 2] [--no-cache]
+"""
+import argparse
+import hashlib
+import importlib.util
+import inspect
+import os
+import sys
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.metrics import accuracy_score
+from sklearn.pipeline import Pipeline
+
+from build_cache import BuildCache, cache_path
+from data_config import DataConfig
+from grid_index import GRID_KEYS
+
+
+def folds_path(root=None):
+    """Directory holding the saved folds, `data/folds` by default."""
+    root = DataConfig.DATA_PATH if root is None else Path(root)
+    return root / "folds"
+
+
+def fingerprint(*objects):
+    """SHA-256 of the content of dataframes, series or arrays."""
+    digest = hashlib.sha256()
+    for obj in objects:
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            digest.update(pd.util.hash_pandas_object(obj, index=False).to_numpy().tobytes())
+        else:
+            digest.update(np.ascontiguousarray(obj).tobytes())
+    return digest.hexdigest()
+
+
+def saved_folds(splitter, X, y, root=None):
+    """
+    Train and test indices of `splitter` on (X, y), computed on the first call and read from
+    `data/folds` afterwards. The file is keyed on the splitter's parameters, the grid columns
+    the blocks are drawn from and the targets, so a different splitter or a rebuilt dataset
+    gets new folds.
+    """
+    grid_columns = [column for column in GRID_KEYS if column in X]
+    key = BuildCache.key({
+        "splitter": repr(splitter),
+        "samples": len(y),
+        "grid": fingerprint(X[grid_columns]) if grid_columns else None,
+        "y": fingerprint(y),
+    })
+    path = folds_path(root) / f"folds-{key[:16]}.npz"
+    if path.exists():
+        with np.load(path) as saved:
+            return [(saved[f"train_{i}"], saved[f"test_{i}"]) for i in range(len(saved.files) // 2)]
+
+    folds = list(splitter.split(X, y))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.stem + ".tmp.npz")
+    arrays = {}
+    for i, (train_index, test_index) in enumerate(folds):
+        arrays[f"train_{i}"], arrays[f"test_{i}"] = train_index, test_index
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+    return folds
+
+
+def load_submission(submission, path="."):
+    """Import `submissions/<submission>/estimator.py`, registered so that its source can be inspected."""
+    module_name = f"submission_{submission}"
+    if module_name not in sys.modules:
+        file = Path(path) / "submissions" / submission / "estimator.py"
+        spec = importlib.util.spec_from_file_location(module_name, file)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[module_name]
+
+
+def split_pipeline(estimator):
+    """(preprocessing, model) of an estimator, preprocessing being None unless it is a multi-step pipeline."""
+    if isinstance(estimator, Pipeline) and len(estimator.steps) > 1:
+        return estimator[:-1], estimator[-1]
+    return None, estimator
+
+
+def source_files(module, root="."):
+    """
+    Files of a submission's code: its `estimator.py` and the modules of the kit under `root`
+    it imports, directly or through each other. Installed packages are left out.
+    """
+    root = Path(root).resolve()
+    files = set()
+    pending = [module]
+    while pending:
+        module = pending.pop()
+        file = Path(module.__file__).resolve()
+        if file in files:
+            continue
+        files.add(file)
+        for value in vars(module).values():
+            imported = value if inspect.ismodule(value) else inspect.getmodule(value)
+            imported_file = getattr(imported, "__file__", None)
+            if imported_file is None:
+                continue
+            imported_file = Path(imported_file).resolve()
+            if imported_file.is_relative_to(root) and "site-packages" not in imported_file.parts:
+                pending.append(imported)
+    return sorted(files)
+
+
+def sources_key(module, root="."):
+    """SHA-256 of the content of a submission's source files."""
+    digest = hashlib.sha256()
+    for file in source_files(module, root):
+        digest.update(file.read_bytes())
+    return digest.hexdigest()
+
+
+def preprocessing_key(preprocessing, sources, data_key, train_index, test_index):
+    """
+    Cache key of a fitted preprocessing: the submission's source files (see `sources_key`),
+    the parameters of its steps, the data and the train and test indices of the fold, so that
+    folds of another splitter are not mixed up.
+    """
+    return BuildCache.key({
+        "sources": sources,
+        "params": repr(preprocessing.get_params(deep=True)),
+        "data": data_key,
+        "fold": fingerprint(train_index, test_index),
+    })
+
+
+def take_rows(data, index):
+    """Rows of a dataframe or series, sliced without copying when the index is a contiguous range."""
+    if len(index) and index[-1] - index[0] + 1 == len(index) and np.all(np.diff(index) == 1):
+        return data.iloc[index[0]:index[-1] + 1]
+    return data.iloc[index]
+
+
+def run_fold(submission, fold, train_index, test_index, data_key, path=".", use_cache=True):
+    """Fit and score a submission on one fold, in a worker process. Returns the fold's results."""
+    import problem
+
+    start = time.perf_counter()
+    X, y = problem.get_train_data(path)
+    module = load_submission(submission, path)
+    preprocessing, model = split_pipeline(module.get_estimator())
+    X_train, y_train = take_rows(X, train_index), take_rows(y, train_index)
+    X_test, y_test = take_rows(X, test_index), take_rows(y, test_index)
+
+    cached = False
+    if preprocessing is not None:
+        key = preprocessing_key(preprocessing, sources_key(module, path), data_key, train_index, test_index)
+        cache_file = cache_path(Path(path) / "data") / "cv" / f"{key}.joblib"
+        if use_cache and cache_file.exists():
+            X_train, X_test = joblib.load(cache_file, mmap_mode="r")
+            cached = True
+        else:
+            X_train = preprocessing.fit_transform(X_train, y_train)
+            X_test = preprocessing.transform(X_test)
+            if use_cache:
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+                joblib.dump((X_train, X_test), cache_file)
+
+    model.fit(X_train, y_train)
+    return {
+        "fold": fold,
+        "accuracy": accuracy_score(y_test, model.predict(X_test)),
+        "preprocessing_cached": cached,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def cross_validate(submission, path=".", n_jobs=1, use_cache=True):
+    """
+    Score a submission on every fold of `problem.get_cv`, `n_jobs` folds at a time.
+    Only `n_jobs` folds are dispatched at once, which bounds the memory used.
+    Returns a dataframe of the folds' results.
+    """
+    import problem
+
+    X, y = problem.get_train_data(path)
+    folds = list(problem.get_cv(X, y))
+    data_key = fingerprint(X, y)
+    del X, y
+
+    results = Parallel(n_jobs=n_jobs, pre_dispatch="n_jobs")(
+        delayed(run_fold)(submission, fold, train_index, test_index, data_key, path, use_cache)
+        for fold, (train_index, test_index) in enumerate(folds)
+    )
+    return pd.DataFrame(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-validate a submission with saved folds and cached preprocessing.")
+    parser.add_argument("--submission", default="base")
+    parser.add_argument("--path", default=".", help="Root of the kit, holding data/ and submissions/.")
+    parser.add_argument("--n-jobs", type=int, default=1, help="Folds trained at once.")
+    parser.add_argument("--no-cache", action="store_true", help="Refit the preprocessing of every fold.")
+    args = parser.parse_args()
+
+    results = cross_validate(args.submission, args.path, args.n_jobs, use_cache=not args.no_cache)
+    print(results.to_string(index=False))
+    print(f"accuracy: {results['accuracy'].mean():.4f} ± {results['accuracy'].std():.4f}")
+
+
+if __name__ == "__main__":
+    main()
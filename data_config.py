@@ -3,6 +3,50 @@ from pathlib import Path
 class DataConfig:
     DATA_PATH = Path("data")
 
+    # Compact dtypes of the processed datasets, applied from decoding to inference.
+    # Coordinates are whole degrees within the Europe box and time is a month start,
+    # in milliseconds, the coarsest unit Parquet round-trips as is.
+    COORDINATE_DTYPES = {"latitude": "int8", "longitude": "int16"}
+    TIME_DTYPE = "datetime64[ms]"
+    MEASUREMENT_DTYPE = "float32"
+
+    # Train/test split and CV folds are drawn over blocks of one year by BLOCK_TILE_DEGREES degrees
+    BLOCK_TILE_DEGREES = 5
+    CV_SPLITS = 5
+    SPLIT_RANDOM_STATE = 57
+
+    # Concurrent requests of download_data.py
+    DOWNLOAD_WORKERS = 4
+
+    # Fitted thresholds of the categorical target, relative to DATA_PATH
+    TARGET_THRESHOLDS_FILE = "target_thresholds.json"
+
+    # Reuse the intermediate artifacts of previous builds (see build_cache.py)
+    USE_BUILD_CACHE = True
+
+    # Memory budget of load_data_chunked, in MB (None: half of the available memory)
+    MEMORY_BUDGET_MB = None
+
+    # Rows scored at once by batch_scoring
+    SCORING_CHUNK_ROWS = 500_000
+
+    # Rows read at once by the streaming training of the experiments (--streaming)
+    TRAINING_CHUNK_ROWS = 500_000
+
+    # How files are coarsened to the 1° x monthly grid: "xarray" (on the grid) or "pandas" (groupby)
+    COARSEN_ENGINE = "xarray"
+
+    # Load the historical precipitation as one lazy Dask graph, computed once on threads (needs dask).
+    # Each variable's yearly members are chunked on time, DASK_CHUNK_MONTHS whole months per chunk.
+    LAZY_LOADING = False
+    DASK_CHUNK_MONTHS = 12
+
+    # How the loaders decode their files: "serial" or "process" (process pool)
+    EXECUTOR = "serial"
+    N_WORKERS = 4
+    # Files being decoded or waiting to be merged at once, bounds the peak memory (default 2 * N_WORKERS)
+    MAX_TASKS_IN_FLIGHT = None
+
     # Time periods
     HISTORICAL_PERIOD = [str(year) for year in range(2000, 2015)]
     PROJECTIONS_PERIOD = [str(year) for year in range(2019, 2031)]
@@ -31,9 +75,18 @@ class DataConfig:
 
     # CMIP6 Projections Data
     PROJECTIONS_DATASET = "projections-cmip6"
-    PROJECTIONS_EXPERIMENTS = ["historical", "ssp1_2_6", "ssp2_4_5", "ssp5_8_5"]
+    # SSP scenarios scored by the experiments, stored as partitions of the `projections` dataset
+    SCENARIOS = ["ssp1_2_6", "ssp2_4_5", "ssp5_8_5"]
+    PROJECTIONS_EXPERIMENTS = ["historical"] + SCENARIOS
     PROJECTIONS_VARIABLES = ["precipitation", "air_temperature","total_runoff","snowfall_flux"]
     PROJECTIONS_MODELS = ["cnrm_cm6_1"]
+    # With several models, the projections are reduced to their ensemble mean, spread and
+    # quantiles as each model is decoded (see ensemble.py). Quantiles are exact for ensembles
+    # of at most ENSEMBLE_BUFFER_SIZE models.
+    ENSEMBLE_QUANTILES = [0.1, 0.9]
+    ENSEMBLE_BUFFER_SIZE = 8
+    # Also keep each model's projections, in the `projection_members` dataset of the store
+    SAVE_PROJECTION_MEMBERS = False
 
     # Flood Risk Data (CEMS GLOFAS)                                                                                                         
     FLOOD_RISK_DATASET = "cems-glofas-historical"
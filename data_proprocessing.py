@@ -1,223 +1,644 @@
+import threading
 import zipfile
-import tempfile
-import os
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 
 import pandas as pd
 import numpy as np
 import xarray as xr
+import netCDF4
 import psutil
 
 from data_config import DataConfig
+from blocked_cv import blocked_train_test_split
+from build_cache import BuildCache
+from data_store import iter_dataset, read_dataset, save_dataset, to_store_schema
+from ensemble import ensemble_grid, reduce_ensemble
+from grid_index import GRID_KEYS, GridIndex
+from labelling import ThresholdLabeller
+from profiling import PROFILER, profiled, stage
+
+# Memory used per decoded grid value while coarsening: the float32 value itself,
+# its int64 cell index, the validity mask and the float64 weights of the reduction
+BYTES_PER_GRID_POINT = 32
+
+# Bump whenever a change to the loaders alters their output, so cached artifacts get rebuilt
+TRANSFORM_VERSION = 3
+
+def transform_inputs():
+    """
+    Settings every cached artifact of the loaders depends on: the transformation version,
+    the dtype schema of the decoded frames and the coarsening engine.
+    """
+    return {
+        "version": TRANSFORM_VERSION,
+        "schema": {
+            "time": DataConfig.TIME_DTYPE,
+            "coordinates": DataConfig.COORDINATE_DTYPES,
+            "measurements": DataConfig.MEASUREMENT_DTYPE,
+        },
+        "coarsen_engine": DataConfig.COARSEN_ENGINE,
+    }
 
 def load_data():
     """
     Load the precipitation dataset and creates a categorical variable for the risk of flooding.
     Load the historical data and join it to the created categorical variable.
-    Load the projections data in the same manner but do not join the categorical variable.
-    Ultimately return the historical + categorical variable (training) and the projections data (inference).
+    Load the projections data of the SSP scenarios in the same pass but do not join the categorical variable.
+    Ultimately return the historical + categorical variable (training), the projections data of all
+    scenarios with a `scenario` column (inference) and the flood risk data.
     """
 
     print("Loading datasets into dataframes...", end="", flush=True)
-    precipitation_df = load_precipitation_data()
+    if DataConfig.LAZY_LOADING:
+        precipitation_df = load_precipitation_data_lazy()
+        categorical_data = precipitation_df[GRID_KEYS + ["target"]]
+    else:
+        precipitation_df = load_precipitation_data()
+        categorical_data = precipitation_df[GRID_KEYS].join(create_categorical_variable(precipitation_df))
     print(f"Precipitation data loaded with {len(precipitation_df)} samples.")
-    categorical_data = create_categorical_variable(precipitation_df)
-    
+    del precipitation_df
+
     print(f"Categorical data created with {len(categorical_data)} samples.")
 
-    historical_df = load_projection_data("historical")
+    # The historical and SSP experiments are decoded in a single pass
+    ensembles = projection_ensembles(["historical"] + DataConfig.SCENARIOS)
+    _, historical_df = next(ensembles)
 
-    train_df = historical_df.join(categorical_data, how="inner")
+    # Each projection row gets the target of its own grid cell
+    train_df = join_on_grid([historical_df, categorical_data], how="inner")
     print(f"Training set loaded with {len(train_df)} samples.")
+    del historical_df, categorical_data
 
-    
-    
-    ssp1_df = load_projection_data("ssp1_2_6")  # Low emissions
-    ssp2_df = load_projection_data("ssp2_4_5")  # Medium emissions
-    ssp5_df = load_projection_data("ssp5_8_5")  # High emissions
+    projections_df = concat_scenarios(ensembles)
+    for scenario, count in projections_df["scenario"].value_counts(sort=False).items():
+        print(f"{scenario} set loaded with {count} samples.")
 
-    print(f"SSP1 set loaded with {len(ssp1_df)} samples.")
-    print(f"SSP2 set loaded with {len(ssp2_df)} samples.")
-    print(f"SSP5 set loaded with {len(ssp5_df)} samples.")
-    
     flood_risk_df = load_flood_risk_data()
     
     print(f"Flood risk set loaded with {len(flood_risk_df)} samples.")
 
-    return train_df, ssp1_df, ssp2_df, ssp5_df, flood_risk_df
+    return train_df, projections_df, flood_risk_df
+
+def load_data_chunked(memory_budget_mb=None, chunk_years=None, test_size=0.2, random_state=DataConfig.SPLIT_RANDOM_STATE):
+    """
+    Out-of-core version of `load_data` for memory-limited nodes.
+    The data is processed a few years at a time (coarsen, label, join) and each chunk is appended
+    to the columnar store, so peak memory depends on the chunk size rather than on the whole period.
+    The chunk size is picked from the memory budget unless `chunk_years` is given.
+
+    As in `load_data`, the categorical target is joined to the historical projections on
+    their grid cells. Writes `precipitation`, `X_train`, `X_test`,
+    `projections` (one partition per SSP scenario) and `flood_risk` to the store.
+    """
+    if chunk_years is None:
+        chunk_years = choose_chunk_years(memory_budget_mb)
+    print(f"Processing {chunk_years} year(s) per chunk.")
+    historical_chunks = list(year_chunks(DataConfig.HISTORICAL_PERIOD, chunk_years))
+
+    # Pass 1: coarsen the precipitation data chunk by chunk. Chunks without data are skipped,
+    # each dataset is only appended to once its first chunk has replaced the previous build's
+    written = False
+    with ZipMemberReader(DataConfig.DATA_PATH / "precipitation.zip") as reader:
+        for years in historical_chunks:
+            with stage(f"precipitation {years[0]}-{years[-1]}") as record:
+                variable_dfs = [
+                    load_precipitation_variable(variable, variable_name, reader, years)
+                    for variable, variable_name in DataConfig.EXTREME_PRECIPITATION_VARIABLES.items()
+                ]
+                variable_dfs = [df for df in variable_dfs if len(df)]
+                if not variable_dfs:
+                    continue
+                precipitation_df = join_on_grid(variable_dfs)
+                save_dataset(precipitation_df, "precipitation", append=written)
+                written = True
+                record.rows_out = len(precipitation_df)
+
+    # The thresholds of the target are fitted over the whole period in a single streaming pass
+    with stage("fit target thresholds"):
+        labeller = ThresholdLabeller(quantile=0.50, min_above=4)
+        for chunk in iter_dataset("precipitation"):
+            labeller.partial_fit(chunk)
+        labeller.save(DataConfig.DATA_PATH / DataConfig.TARGET_THRESHOLDS_FILE)
+
+    # Pass 2: label each chunk, join it to the historical projections and split it
+    written = False
+    for years in historical_chunks:
+        with stage(f"training set {years[0]}-{years[-1]}") as record:
+            precipitation_df = read_dataset("precipitation", years=(int(years[0]), int(years[-1])))
+            if precipitation_df.empty:
+                continue
+            record.rows_in = len(precipitation_df)
+            target_df = precipitation_df[GRID_KEYS].join(create_categorical_variable(precipitation_df, labeller))
+
+            _, historical_df = next(projection_ensembles(["historical"], years, append=written))
+            train_df = join_on_grid([historical_df, target_df], how="inner")
+            X_train, X_test = blocked_train_test_split(train_df, test_size=test_size, random_state=random_state)
+            save_dataset(X_train, "X_train", append=written)
+            save_dataset(X_test, "X_test", append=written)
+            written = True
+            record.rows_out = len(train_df)
+
+    # Every scenario of a chunk of years is decoded and written at once
+    written = False
+    for years in year_chunks(DataConfig.PROJECTIONS_PERIOD, chunk_years):
+        with stage(f"projections {years[0]}-{years[-1]}") as record:
+            projections_df = concat_scenarios(projection_ensembles(DataConfig.SCENARIOS, years, append=written))
+            save_dataset(projections_df, "projections", append=written)
+            written = True
+            record.rows_out = len(projections_df)
+
+    written = False
+    for years in year_chunks(DataConfig.FLOOD_DATA_PERIOD, chunk_years):
+        with stage(f"flood risk {years[0]}-{years[-1]}") as record:
+            flood_risk_df = pd.concat([
+                load_flood_risk_file(DataConfig.DATA_PATH / f"flood_risk_{year}_{year}.zip") for year in years
+            ]).dropna()
+            save_dataset(flood_risk_df, "flood_risk", append=written)
+            written = True
+            record.rows_out = len(flood_risk_df)
+
+def projection_ensembles(experiments, years=None, append=False):
+    """
+    Yield the `(experiment, dataframe)` projections of several experiments, in order, in a single pass.
+    The files of every experiment, model and variable go through one `build_units` call, so with
+    the process executor they are decoded by the same pool, the next experiment's files being
+    decoded while the previous one is merged. The variables of each model are joined, then folded
+    into the ensemble statistics of all models before the next model is loaded, so that only one
+    model is held in memory. Experiments over the same period share one grid index.
+    Each file is cached separately, keyed on the hash of its zip; with `years`, only those
+    consecutive years are decoded, bypassing the build cache.
+    """
+    cache = BuildCache(enabled=False) if years is not None else BuildCache()
+    units = []
+    for experiment in experiments:
+        for model in DataConfig.PROJECTIONS_MODELS:
+            for variable in DataConfig.PROJECTIONS_VARIABLES:
+                zip_path = DataConfig.DATA_PATH / f"{experiment}_{variable}_{model}.zip"
+                inputs = {
+                    **transform_inputs(),
+                    "zip": cache.file_hash(zip_path),
+                }
+                units.append((f"{experiment}/{variable}_{model}", inputs, load_projection_file,
+                              (experiment, variable, model, years)))
+
+    # Files are decoded in (experiment, model, variable) order, each model's variables are taken in turn
+    variable_dfs = build_units(cache, "projections", units)
+    grids = {}
+    for experiment in experiments:
+        period = years or (DataConfig.HISTORICAL_PERIOD if experiment == "historical" else DataConfig.PROJECTIONS_PERIOD)
+        grid = grids.setdefault((period[0], period[-1]), ensemble_grid(period))
+        model_frames = (
+            (model, join_on_grid(list(islice(variable_dfs, len(DataConfig.PROJECTIONS_VARIABLES)))))
+            for model in DataConfig.PROJECTIONS_MODELS
+        )
+        yield experiment, reduce_ensemble(model_frames, grid, DataConfig.PROJECTIONS_VARIABLES, experiment, append)
+
+def concat_scenarios(ensembles):
+    """Single dataframe of `(scenario, dataframe)` projections, with a categorical `scenario` column."""
+    scenarios, frames = zip(*[(scenario, dataframe.assign(scenario=scenario)) for scenario, dataframe in ensembles])
+    projections_df = pd.concat(frames, ignore_index=True)
+    projections_df["scenario"] = pd.Categorical(projections_df["scenario"], categories=list(scenarios))
+    return projections_df
+
+def year_chunks(period, chunk_years):
+    """Split a list of years into lists of at most `chunk_years` consecutive years."""
+    for start in range(0, len(period), chunk_years):
+        yield period[start:start + chunk_years]
 
+def choose_chunk_years(memory_budget_mb=None):
+    """
+    Number of years to process per chunk so that the decoded grids of a chunk fit in the memory budget:
+    `memory_budget_mb`, `DataConfig.MEMORY_BUDGET_MB`, or half of the available memory when both are unset.
+    A precipitation file and a flood risk file are decoded one at a time whatever the chunk size,
+    while the projections are decoded one variable at a time for every year of the chunk.
+    """
+    memory_budget_mb = memory_budget_mb or DataConfig.MEMORY_BUDGET_MB
+    if memory_budget_mb is None:
+        memory_budget_mb = psutil.virtual_memory().available / 1024 ** 2 / 2
+
+    with ZipMemberReader(DataConfig.DATA_PATH / "precipitation.zip") as reader:
+        with reader.open_dataset(reader.netcdf_members()[0]) as dataset:
+            fixed_points = _grid_points_per_year(dataset)
+    with ZipMemberReader(DataConfig.DATA_PATH / f"flood_risk_{DataConfig.FLOOD_DATA_PERIOD[0]}_{DataConfig.FLOOD_DATA_PERIOD[0]}.zip") as reader:
+        with reader.open_netcdf_members() as dataset:
+            fixed_points = max(fixed_points, _grid_points_per_year(dataset))
+
+    points_per_year = 0
+    for variable in DataConfig.PROJECTIONS_VARIABLES:
+        for model in DataConfig.PROJECTIONS_MODELS:
+            with ZipMemberReader(DataConfig.DATA_PATH / f"historical_{variable}_{model}.zip") as reader:
+                with reader.open_netcdf_members() as dataset:
+                    points_per_year = max(points_per_year, _grid_points_per_year(dataset))
+
+    available_bytes = memory_budget_mb * 1024 ** 2 - fixed_points * BYTES_PER_GRID_POINT
+    return max(1, int(available_bytes // (points_per_year * BYTES_PER_GRID_POINT)))
+
+def _grid_points_per_year(dataset):
+    """Number of gridded values one year of the dataset decodes to, over all its variables."""
+    time_dimension = "valid_time" if "valid_time" in dataset.dims else "time"
+    points = sum(
+        data.size for data in dataset.data_vars.values() if time_dimension in data.dims and data.ndim >= 3
+    )
+    return points / dataset.sizes[time_dimension] * 12
+
+@profiled()
 def load_precipitation_data():
     """
     Goes into the zip file and loads the precipitation data for each variable for each year
     and merge everything into a single dataframe.
+    Each variable is cached separately, keyed on the CRCs of its yearly members.
     """
-    precipitation_df = pd.DataFrame()
-    for variable, variable_name in DataConfig.EXTREME_PRECIPITATION_VARIABLES.items():
-        print(f"Loading {variable_name} data...")
-        variable_df_list = []
-        for year in DataConfig.HISTORICAL_PERIOD:
-            file_name = (
-                f"{variable_name}_europe_e-obs_monthly_99th_{year}_v1.nc"
-                if "percentile" in variable_name
-                else f"{variable_name}_europe_e-obs_monthly_{year}_v1.nc"
-            )
-            # Go fetch this file in the zip file
-            zip_path = DataConfig.DATA_PATH / "precipitation.zip"
-            # Create a temporary file
-            with tempfile.NamedTemporaryFile(delete=True) as tmp_file:
-                temp_file_path = tmp_file.name
-
-                # Open the ZIP file
-                with zipfile.ZipFile(zip_path, 'r') as z:
-                    #check if the file is in the zip
-                    if file_name not in z.namelist():
-                        print(f"{file_name} not found in the zip !")
-                        continue
-                    # Extract the file inside the ZIP to the temporary file
-                    with z.open(file_name) as f:
-                        tmp_file.write(f.read())
-
-                # Load the NetCDF file with xarray
-                dataset = xr.open_dataset(temp_file_path, engine='netcdf4').to_dataframe()
-
-                dataset.columns = [variable]
-
-                variable_df_list.append(dataset.reset_index())
-
-
-        # Concatenate all yearly data for the current variable
-        variable_df = pd.concat(variable_df_list).dropna()
-        variable_df = easier_coordinates(variable_df)
-   
-
-        # Merge the data for all variables
-        if precipitation_df.empty:
-            precipitation_df = variable_df
-        else:
-            precipitation_df = precipitation_df.merge(variable_df, on=['time', 'latitude', 'longitude'], how='outer')
-            
-        print_memory_usage(f"Loaded {variable_name} data.")
+    cache = BuildCache()
+    # Open the zip file once and reuse its member index for every (variable, year)
+    with ZipMemberReader(DataConfig.DATA_PATH / "precipitation.zip") as reader:
+        # Worker processes open the zip themselves, the reader cannot be sent to them
+        shared_reader = reader if DataConfig.EXECUTOR == "serial" else None
+        units = []
+        for variable, variable_name in DataConfig.EXTREME_PRECIPITATION_VARIABLES.items():
+            file_names = [precipitation_file_name(variable_name, year) for year in DataConfig.HISTORICAL_PERIOD]
+            inputs = {
+                **transform_inputs(),
+                "variable": variable,
+                "period": DataConfig.HISTORICAL_PERIOD,
+                "members": {name: reader.members[name].CRC for name in file_names if name in reader},
+            }
+            units.append((variable, inputs, load_precipitation_variable, (variable, variable_name, shared_reader)))
+
+        variable_dfs = list(build_units(cache, "precipitation", units))
+
+    # Merge the data for all variables
+    precipitation_df = join_on_grid(variable_dfs)
+    return precipitation_df
+
+def load_precipitation_data_lazy(chunk_months=None):
+    """
+    Lazy counterpart of `load_precipitation_data` followed by `create_categorical_variable`.
+    The yearly members of each variable are opened as one dataset chunked on time, each chunk
+    is coarsened on the grid, and the join and the labelling run on the coarsened frames, all
+    as a single Dask graph computed once on the threaded scheduler. Only the compressed
+    members and the chunks being decoded are held in memory, so a longer period adds chunks
+    rather than memory. Returns the precipitation dataframe with its `target` column.
+    The build cache is not used.
+    """
+    import dask
+
+    chunk_months = chunk_months or DataConfig.DASK_CHUNK_MONTHS
+    with ZipMemberReader(DataConfig.DATA_PATH / "precipitation.zip") as reader:
+        variable_dfs = []
+        for variable, variable_name in DataConfig.EXTREME_PRECIPITATION_VARIABLES.items():
+            dataset = open_precipitation_variable(reader, variable, variable_name, chunk_months)
+            variable_dfs.append(coarsen_lazy(dataset, variable))
+
+    labelled = dask.delayed(_join_and_label)(variable_dfs)
+    with stage("precipitation graph"):
+        (precipitation_df,) = dask.compute(labelled, scheduler="threads", num_workers=DataConfig.N_WORKERS)
     return precipitation_df
 
-def print_memory_usage(message):
-    """Print the current memory usage with a custom message."""
-    process = psutil.Process(os.getpid())
-    mem_info = process.memory_info()
-    print(f"{message} Memory usage: {mem_info.rss / (1024 ** 2):.2f} MB")
+def open_precipitation_variable(reader, variable, variable_name, chunk_months):
+    """
+    The yearly members of one variable as a single dataset backed by Dask arrays,
+    each chunk holding `chunk_months` whole months (`open_mfdataset` over the zip members).
+    Members are only read for their coordinates here, their values are decoded by the tasks
+    of the graph, so no member stays in memory until the graph is computed.
+    Returns None when none of the members is in the zip.
+    """
+    import dask
+    import dask.array as da
+
+    members = []
+    for year in DataConfig.HISTORICAL_PERIOD:
+        file_name = precipitation_file_name(variable_name, year)
+        if file_name not in reader:
+            print(f"{file_name} not found in the zip !")
+            continue
+        with reader.open_dataset(file_name) as dataset:
+            values = dataset[list(dataset.data_vars)[0]].transpose(*GRID_KEYS)
+            coordinates = {key: values[key].values for key in GRID_KEYS}
+            shape = values.shape
+        data = da.from_delayed(dask.delayed(_read_member)(reader.zip_path, file_name), shape,
+                               dtype=DataConfig.MEASUREMENT_DTYPE)
+        members.append(xr.DataArray(data, coords=coordinates, dims=GRID_KEYS, name=variable))
+    if not members:
+        return None
+
+    array = xr.concat(members, dim="time")
+    return array.chunk({"time": month_chunks(array["time"].values, chunk_months)}).to_dataset()
+
+# The netCDF library is not thread-safe, members are decoded one at a time
+_NETCDF_LOCK = threading.Lock()
+
+def _read_member(zip_path, file_name):
+    """Values of the data variable of a precipitation member, as a (time, latitude, longitude) array."""
+    with _NETCDF_LOCK, ZipMemberReader(zip_path) as reader, reader.open_dataset(file_name) as dataset:
+        values = dataset[list(dataset.data_vars)[0]].transpose(*GRID_KEYS).values
+    return values.astype(DataConfig.MEASUREMENT_DTYPE)
+
+def month_chunks(times, chunk_months):
+    """Chunk sizes along a sorted time axis, so that every chunk holds `chunk_months` whole months."""
+    months = pd.DatetimeIndex(times).to_period("M")
+    month_starts = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+    return tuple(np.diff(np.r_[month_starts[::chunk_months], len(months)]).tolist())
+
+def coarsen_lazy(dataset, variable):
+    """
+    Delayed dataframe of `dataset` coarsened on the grid, chunk by chunk. As chunks hold
+    whole months, each coarsened cell comes from a single chunk and the chunks' frames
+    only need to be concatenated.
+    """
+    import dask
+
+    if dataset is None:
+        return pd.DataFrame(columns=GRID_KEYS + [variable])
+
+    array = dataset[variable].data
+    bounds = np.cumsum((0,) + array.chunks[0])
+    times = dataset["time"].values
+    coordinates = (dataset["latitude"].values, dataset["longitude"].values)
+    chunk_dfs = [
+        dask.delayed(_coarsen_chunk)(block, times[start:stop], *coordinates, variable)
+        for block, start, stop in zip(array.to_delayed().ravel(), bounds[:-1], bounds[1:])
+    ]
+    return dask.delayed(pd.concat)(chunk_dfs, ignore_index=True)
+
+def _coarsen_chunk(values, times, latitudes, longitudes, variable):
+    dataset = xr.Dataset(
+        {variable: (GRID_KEYS, values)},
+        coords={"time": times, "latitude": latitudes, "longitude": longitudes},
+    )
+    return coarsen_grid(dataset, [variable])
+
+def _join_and_label(variable_dfs):
+    precipitation_df = join_on_grid(variable_dfs)
+    return precipitation_df.join(create_categorical_variable(precipitation_df))
+
+def precipitation_file_name(variable_name, year):
+    """Name of the yearly NetCDF member of `precipitation.zip` for a variable."""
+    return (
+        f"{variable_name}_europe_e-obs_monthly_99th_{year}_v1.nc"
+        if "percentile" in variable_name
+        else f"{variable_name}_europe_e-obs_monthly_{year}_v1.nc"
+    )
+
+@profiled()
+def load_precipitation_variable(variable, variable_name, reader=None, years=None):
+    """
+    Load every yearly file of one precipitation variable (or only those of `years`) and coarsen it.
+    """
+    if reader is None:
+        with ZipMemberReader(DataConfig.DATA_PATH / "precipitation.zip") as reader:
+            return load_precipitation_variable(variable, variable_name, reader, years)
+
+    print(f"Loading {variable_name} data...")
+    variable_df_list = []
+    for year in DataConfig.HISTORICAL_PERIOD if years is None else years:
+        file_name = precipitation_file_name(variable_name, year)
+        #check if the file is in the zip
+        if file_name not in reader:
+            print(f"{file_name} not found in the zip !")
+            continue
+
+        # Load the NetCDF file with xarray straight from memory and coarsen it on the grid
+        with reader.open_dataset(file_name) as dataset:
+            dataset = dataset.rename({list(dataset.data_vars)[0]: variable})
+            variable_df_list.append(coarsen(dataset, [variable]))
+
+    if not variable_df_list:
+        return pd.DataFrame(columns=GRID_KEYS + [variable])
+
+    # Concatenate all yearly data for the current variable
+    return pd.concat(variable_df_list, ignore_index=True)
+
+def memory_report(dataframes):
+    """
+    Print and return the memory footprint of named dataframes with the compact schema,
+    next to what the same rows take with float64 numbers and datetime64[ns] times.
+    """
+    rows = []
+    for name, dataframe in dataframes.items():
+        compact = dataframe.memory_usage(deep=True, index=False).sum()
+        wide = sum(
+            8 * len(dataframe) if pd.api.types.is_numeric_dtype(dataframe[column])
+            or pd.api.types.is_datetime64_any_dtype(dataframe[column])
+            else dataframe[column].memory_usage(deep=True, index=False)
+            for column in dataframe.columns
+        )
+        rows.append({"dataset": name, "rows": len(dataframe),
+                     "compact_mb": compact / 1024 ** 2, "float64_mb": wide / 1024 ** 2})
+    report = pd.DataFrame(rows)
+    report["saving"] = 1 - report["compact_mb"] / report["float64_mb"]
+    print(report.to_string(index=False, float_format=lambda x: f"{x:.2f}"))
+    return report
     
     
+@profiled()
 def load_projection_data(experiment):
     """
     Goes into the zip file and loads the projections data for each variable for each year
-    and merge everything into a single dataframe.
+    and merge everything into a single dataframe (see `projection_ensembles`).
     """
-    projections_df = pd.DataFrame()
-    for variable in DataConfig.PROJECTIONS_VARIABLES:
-        for model in DataConfig.PROJECTIONS_MODELS:
-            file_name = f"{experiment}_{variable}_{model}.zip"
-            # Go fetch this file in the zip file
-            zip_path = DataConfig.DATA_PATH / file_name
-            # Create a temporary file
-            with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-                # Open the ZIP file
-                with zipfile.ZipFile(zip_path, 'r') as z:
-                    temp_file_path = tmp_file.name
-                    # Extract only the .nc files inside the ZIP to the temporary directory
-                    for file_info in z.infolist():
-                        if file_info.filename.endswith('.nc'):
-                            with z.open(file_info.filename) as f:
-                                    tmp_file.write(f.read())
-
-                # Load the NetCDF files with xarray
-                dataset = xr.open_dataset(
-                    os.path.join(temp_file_path),
-                    engine='netcdf4',
-                ).to_dataframe().reset_index()
-
-                columns_to_keep = ['lat', 'lon', 'time', dataset.columns[-1]]
-                dataset = dataset[columns_to_keep]
-                dataset.columns = ["latitude", "longitude", "time", variable]
-                dataset = dataset[["time", "latitude", "longitude", variable]]
-                dataset = easier_coordinates(dataset.dropna())
-
-                # Merge the data for all models
-                if projections_df.empty:
-                    projections_df = dataset
-                else:
-                    projections_df = projections_df.merge(dataset, on=['time', 'latitude', 'longitude'], how='outer')
-
-                os.remove(temp_file_path)
-
+    _, projections_df = next(projection_ensembles([experiment]))
     return projections_df
 
+@profiled()
+def load_projection_file(experiment, variable, model, years=None):
+    """
+    Load the projections of one variable for one model and coarsen them.
+    `years` restricts the decoding to a list of consecutive years.
+    """
+    file_name = f"{experiment}_{variable}_{model}.zip"
+    # Go fetch this file in the zip file
+    zip_path = DataConfig.DATA_PATH / file_name
+
+    # Load the NetCDF files with xarray straight from memory and coarsen them on the grid
+    with ZipMemberReader(zip_path) as reader:
+        with reader.open_netcdf_members() as dataset:
+            dataset = dataset.rename({"lat": "latitude", "lon": "longitude"})
+            # Keep the gridded variable, not the bounds variables that come along with it
+            gridded = [name for name, data in dataset.data_vars.items() if set(data.dims) == set(GRID_KEYS)]
+            dataset = dataset.rename({gridded[-1]: variable})
+            if years is not None:
+                dataset = dataset.sel(time=slice(str(years[0]), str(years[-1])))
+            return coarsen(dataset, [variable])
+
+@profiled()
 def load_flood_risk_data():
     """
     Goes into the zip files and loads the flood risk data for each variable for each year
     and merge everything into a single dataframe.
+    Each yearly zip is cached separately, keyed on its hash.
+    """
+    cache = BuildCache()
+    zip_paths = [DataConfig.DATA_PATH / f"flood_risk_{year}_{year}.zip" for year in DataConfig.FLOOD_DATA_PERIOD]
+
+    # Concatenate all yearly data
+    flood_risk_df = pd.concat(build_units(cache, "flood_risk", flood_risk_units(cache, zip_paths))).dropna()
+
+    return flood_risk_df
+
+def flood_risk_units(cache, zip_paths):
+    """
+    Build units of flood risk zips, named after the period in their file name
+    (`flood_risk_2000_2000.zip` is unit `2000_2000`).
+    """
+    return [
+        (Path(zip_path).stem.removeprefix("flood_risk_"),
+         {**transform_inputs(), "zip": cache.file_hash(zip_path)},
+         load_flood_risk_file, (zip_path,))
+        for zip_path in zip_paths
+    ]
+
+@profiled()
+def load_flood_risk_file(zip_path):
     """
-    flood_risk_df = pd.DataFrame()
-    year_df_list = []
-    for start_year in range(2000, 2025, 1):
-        end_year = min(start_year + 0, 2024)
-        file_name = f"flood_risk_{start_year}_{end_year}.zip"
-        zip_path = DataConfig.DATA_PATH / file_name
-
-        # Create a temporary file
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-            temp_file_path = tmp_file.name
-
-            # Open the ZIP file
-            with zipfile.ZipFile(zip_path, 'r') as z:
-                # Extract only the .nc files inside the ZIP to the temporary directory
-                for file_info in z.infolist():
-                    if file_info.filename.endswith('.nc'):
-                        with z.open(file_info.filename) as f:
-                            tmp_file.write(f.read())
-            
+    Load one yearly flood risk zip and coarsen it.
+    """
+    # Load the NetCDF files with xarray straight from memory and coarsen them on the grid
+    with ZipMemberReader(zip_path) as reader:
+        with reader.open_netcdf_members() as dataset:
             print(f"extracted zip file {zip_path}")
 
-            # Load the NetCDF files with xarray
-            dataset = xr.open_dataset(
-                os.path.join(temp_file_path),
-                engine='netcdf4',
-            ).to_dataframe().reset_index()
+            #rename valid_time to time to match the other datasets
+            dataset = dataset.rename({"valid_time": "time"})
+            variables = [name for name, data in dataset.data_vars.items() if set(data.dims) == set(GRID_KEYS)]
+            return coarsen(dataset, variables)
 
-            #rename valid_time column to time to match the other datasets
-            dataset = dataset.rename(columns={"valid_time": "time"})
-            dataset = easier_coordinates(dataset.dropna())
+@profiled()
+def join_on_grid(frames, how="outer"):
+    """
+    Join dataframes that live on the same (time, latitude, longitude) grid in a single step,
+    on the integer cell ids of a `GridIndex` spanning them.
+    Gives the same result as chaining `merge(on=GRID_KEYS, how=how)`, sorted by grid cell.
+    """
+    frames = list(frames)
+    return GridIndex.from_frames(frames).join(frames, how=how)
 
-            year_df_list.append(dataset)
+def build_units(cache, kind, units):
+    """
+    Yield the dataframe of each unit, in order. A unit is a `(name, inputs, build, args)` tuple:
+    up-to-date units are read from the cache, the others are built with `build(*args)`
+    through `map_units` and added to the cache.
+    """
+    missing = [unit for unit in units if not cache.has(kind, unit[0], unit[1])]
+    built = map_units([(build, args) for _, _, build, args in missing])
 
-            os.remove(temp_file_path)
+    for name, inputs, _, _ in units:
+        if cache.has(kind, name, inputs):
+            yield cache.get(kind, name, inputs)
+        else:
+            dataframe = next(built)
+            cache.put(kind, name, inputs, dataframe)
+            yield dataframe
 
-        # Concatenate all yearly data for the current variable
-        variable_df = pd.concat(year_df_list).dropna()
+def map_units(tasks):
+    """
+    Run `function(*args)` for each `(function, args)` task and yield the results in order.
+    With `DataConfig.EXECUTOR == "process"` the tasks run in a process pool, and no more than
+    `DataConfig.MAX_TASKS_IN_FLIGHT` results are pending at once so memory stays bounded.
+    """
+    if DataConfig.EXECUTOR == "serial" or len(tasks) <= 1:
+        for function, args in tasks:
+            yield function(*args)
+        return
+
+    max_in_flight = DataConfig.MAX_TASKS_IN_FLIGHT or 2 * DataConfig.N_WORKERS
+    with ProcessPoolExecutor(
+        max_workers=min(DataConfig.N_WORKERS, len(tasks)),
+        initializer=_init_worker,
+        initargs=(config_snapshot(),),
+    ) as executor:
+        tasks = iter(tasks)
+        pending = deque(executor.submit(function, *args) for function, args in islice(tasks, max_in_flight))
+        while pending:
+            result = pending.popleft().result()
+            # Refill the slot freed by this result before handing it over to be merged
+            for function, args in islice(tasks, 1):
+                pending.append(executor.submit(function, *args))
+            yield result
+
+def config_snapshot():
+    """Settings of `DataConfig` as set by the caller, to be applied in worker processes."""
+    return {name: value for name, value in vars(DataConfig).items() if name.isupper()}
+
+def _init_worker(config):
+    # Workers may be spawned rather than forked, carry over the settings of the caller
+    # (data path, periods, dtypes, coarsening engine...) instead of the defaults
+    for name, value in config.items():
+        setattr(DataConfig, name, value)
+    # Their stages are not collected, keep them quiet
+    PROFILER.print_depth = None
+
+class ZipMemberReader:
+    """
+    Open a zip archive once, index its members by name and hand their NetCDF content
+    to xarray from memory, without writing temporary files to disk.
+    """
 
-    # Merge the data for all variables
-    if flood_risk_df.empty:
-        flood_risk_df = variable_df
-    else:
-        flood_risk_df = flood_risk_df.merge(variable_df, on=['time', 'latitude', 'longitude'], how='outer')
+    def __init__(self, zip_path):
+        self.zip_path = zip_path
+        self._zip = zipfile.ZipFile(zip_path, 'r')
+        self.members = {info.filename: info for info in self._zip.infolist()}
 
-    # Save the flood risk data to a CSV file
-    flood_risk_df.to_csv(DataConfig.DATA_PATH / 'flood_risk_data.csv', index=False)
+    def __contains__(self, name):
+        return name in self.members
 
-    return flood_risk_df
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._zip.close()
+
+    def netcdf_members(self):
+        """Names of the .nc members of the archive, in archive order."""
+        return [name for name in self.members if name.endswith('.nc')]
+
+    def read(self, name):
+        """Decompressed bytes of a single member."""
+        with stage("zip.read"):
+            return self._zip.read(self.members[name])
 
-def create_categorical_variable(precipitation_df):
+    def open_dataset(self, name):
+        """Open a single NetCDF member as an xarray dataset backed by its in-memory bytes."""
+        return open_netcdf_bytes(self.read(name), name)
+
+    def open_netcdf_members(self):
+        """Open every NetCDF member of the archive and combine them into a single dataset."""
+        names = self.netcdf_members()
+        if len(names) == 1:
+            return self.open_dataset(names[0])
+        return xr.combine_by_coords([self.open_dataset(name) for name in names])
+
+
+@profiled("netcdf.open")
+def open_netcdf_bytes(data, name="inmemory.nc"):
     """
-    Create a categorical variable for the risk of flooding based on the precipitation data.
-    A row is classified as 'high' if at least 3 variables are above the 50th percentile.
+    Open NetCDF content held in memory with the netCDF4 engine.
+    The bytes are read in place by the netCDF library, no copy ends up on disk.
     """
-    # Calculate the 50th percentile for each variable
-    percentiles = precipitation_df.quantile(0.50)
+    nc_dataset = netCDF4.Dataset(name, mode='r', memory=data)
+    return xr.open_dataset(xr.backends.NetCDF4DataStore(nc_dataset))
 
-    # Initialize the categorical data with 'low'
-    categorical_data = pd.DataFrame(index=precipitation_df.index)
-    categorical_data["target"] = "low"
 
-    # Check if at least 3 variables are above their respective 50th percentile
-    above_percentile_count = (precipitation_df > percentiles).sum(axis=1)
-    categorical_data.loc[above_percentile_count >= 4, "target"] = "high"
+@profiled()
+def create_categorical_variable(precipitation_df, labeller=None):
+    """
+    Create a categorical variable for the risk of flooding based on the precipitation data.
+    A row is classified as high risk (1) if at least 4 of the precipitation variables are above
+    their 50th percentile, and low risk (0) otherwise. The labels are int8.
+    A fitted `labeller` can be given when labelling part of the data with thresholds computed
+    over all of it (see `load_data_chunked`). Otherwise the thresholds are fitted on
+    `precipitation_df` and saved to `DataConfig.TARGET_THRESHOLDS_FILE`.
+    """
+    if labeller is None:
+        labeller = ThresholdLabeller(quantile=0.50, min_above=4).fit(precipitation_df)
+        labeller.save(DataConfig.DATA_PATH / DataConfig.TARGET_THRESHOLDS_FILE)
+
+    categorical_data = pd.DataFrame({"target": labeller.transform(precipitation_df)}, index=precipitation_df.index)
 
     # Summarize the categorical data distribution
     print("Categorical data distribution:")
@@ -225,6 +646,57 @@ def create_categorical_variable(precipitation_df):
 
     return categorical_data
 
+@profiled()
+def coarsen(dataset, variables):
+    """
+    Coarsen the `variables` of a (time, latitude, longitude) dataset to the 1° x monthly grid
+    with the engine set in `DataConfig.COARSEN_ENGINE`, and return them as a dataframe.
+    """
+    # Measurements are decoded straight to the compact dtype of the schema
+    dataset = dataset[variables].astype(DataConfig.MEASUREMENT_DTYPE)
+    if DataConfig.COARSEN_ENGINE == "pandas":
+        dataframe = dataset.to_dataframe().reset_index()
+        return to_store_schema(easier_coordinates(dataframe[GRID_KEYS + variables].dropna()))
+    return coarsen_grid(dataset, variables)
+
+def coarsen_grid(dataset, variables):
+    """
+    Gridded equivalent of `easier_coordinates` on the flattened dataset: every point is
+    assigned an integer (month, rounded latitude, rounded longitude) cell, and the non-missing
+    values are averaged per cell with `np.bincount`. Only the coarsened cells reach pandas.
+    Points where any of the variables is missing are ignored, like `dropna()` does.
+    """
+    arrays = [dataset[variable].transpose(*GRID_KEYS).values for variable in variables]
+
+    latitudes, latitude_index = np.unique(np.round(dataset["latitude"].values), return_inverse=True)
+    longitudes, longitude_index = np.unique(np.round(dataset["longitude"].values), return_inverse=True)
+    months = pd.DatetimeIndex(dataset["time"].values).to_period('M').to_timestamp()
+    time_index, months = pd.factorize(months, sort=True)
+
+    n_latitudes, n_longitudes = len(latitudes), len(longitudes)
+    cells = (
+        (time_index[:, None, None] * n_latitudes + latitude_index[None, :, None]) * n_longitudes
+        + longitude_index[None, None, :]
+    )
+
+    valid = np.logical_and.reduce([~np.isnan(array) for array in arrays])
+    cells = np.broadcast_to(cells, valid.shape)[valid]
+    n_cells = len(months) * n_latitudes * n_longitudes
+
+    counts = np.bincount(cells, minlength=n_cells)
+    present = np.flatnonzero(counts)
+
+    dataframe = pd.DataFrame({
+        "time": months[present // (n_latitudes * n_longitudes)].astype(DataConfig.TIME_DTYPE),
+        "latitude": latitudes[present // n_longitudes % n_latitudes].astype(DataConfig.COORDINATE_DTYPES["latitude"]),
+        "longitude": longitudes[present % n_longitudes].astype(DataConfig.COORDINATE_DTYPES["longitude"]),
+    })
+    for variable, array in zip(variables, arrays):
+        sums = np.bincount(cells, weights=array[valid], minlength=n_cells)[present]
+        dataframe[variable] = (sums / counts[present]).astype(array.dtype)
+    return dataframe
+
+@profiled()
 def easier_coordinates(dataframe):
     """
     Round the coordinates to the closest multiple of 5 to make them easier to work with and group.
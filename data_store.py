@@ -0,0 +1,193 @@
+import shutil
+import uuid
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from data_config import DataConfig
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("scenario", pa.string()), ("year", pa.int16())]),
+    flavor="hive",
+)
+
+
+def store_path(root=None):
+    """Directory holding the columnar store, `data/store` by default."""
+    root = DataConfig.DATA_PATH if root is None else Path(root)
+    return root / "store"
+
+
+def to_store_schema(dataframe):
+    """
+    Cast a processed dataframe to the compact dtypes declared in `DataConfig`:
+    datetime64[ms] time, int8/int16 coordinates and float32 measurements.
+    Any other column (e.g. the target) is kept as is.
+    """
+    dataframe = dataframe.copy()
+    for column in dataframe.columns:
+        if column == "time":
+            dataframe[column] = pd.to_datetime(dataframe[column]).astype(DataConfig.TIME_DTYPE)
+        elif column in DataConfig.COORDINATE_DTYPES:
+            dataframe[column] = dataframe[column].round().astype(DataConfig.COORDINATE_DTYPES[column])
+        elif pd.api.types.is_float_dtype(dataframe[column]):
+            dataframe[column] = dataframe[column].astype(DataConfig.MEASUREMENT_DTYPE)
+    return dataframe
+
+
+def save_dataset(dataframe, name, scenario=None, root=None, csv_file=None, append=False):
+    """
+    Write a processed dataframe to the store as Parquet, partitioned by scenario and year.
+    The dataset (or only the scenario, when one is given) is replaced unless `append` is set,
+    in which case the rows are added next to the ones already stored.
+    Without `scenario`, the rows of a dataframe with a `scenario` column are partitioned by it.
+    If `csv_file` is given the dataframe is also exported to that CSV file.
+    """
+    if csv_file is not None:
+        dataframe.to_csv(csv_file, index=False)
+
+    dataset_path = store_path(root) / name
+    dataframe = to_store_schema(dataframe)
+    if scenario is not None or "scenario" not in dataframe:
+        dataframe["scenario"] = "all" if scenario is None else scenario
+    dataframe["scenario"] = dataframe["scenario"].astype(str)
+    dataframe["year"] = dataframe["time"].dt.year.astype("int16")
+
+    replaced_path = dataset_path if scenario is None else dataset_path / f"scenario={scenario}"
+    if not append and replaced_path.exists():
+        shutil.rmtree(replaced_path)
+
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    ds.write_dataset(
+        table,
+        dataset_path,
+        format="parquet",
+        partitioning=PARTITIONING,
+        # Unique file names so that appended rows never overwrite existing files
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def dataset_exists(name, root=None):
+    return (store_path(root) / name).exists()
+
+
+def dataset_columns(name, root=None):
+    """Columns of a stored dataset, read from the Parquet schema only."""
+    dataset = ds.dataset(store_path(root) / name, format="parquet", partitioning=PARTITIONING)
+    return [field for field in dataset.schema.names if field not in ("scenario", "year")]
+
+
+def read_dataset(name, columns=None, years=None, scenario=None, root=None, csv_file=None):
+    """
+    Read a dataset from the store, only touching the requested columns and partitions.
+
+    - `columns`: list of columns to load, all columns if None.
+    - `years`: inclusive (first_year, last_year) range, pushed down to the partitions.
+    - `scenario`: scenario name or list of names to load.
+    - `csv_file`: legacy CSV to fall back to when the dataset is not in the store.
+    """
+    if not dataset_exists(name, root):
+        if csv_file is None:
+            raise FileNotFoundError(f"{name} not found in {store_path(root)}")
+        return _read_csv_fallback(csv_file, columns, years)
+
+    dataset = ds.dataset(store_path(root) / name, format="parquet", partitioning=PARTITIONING)
+    if columns is None:
+        columns = dataset_columns(name, root)
+
+    return dataset.to_table(columns=columns, filter=_filter_expression(years, scenario)).to_pandas()
+
+
+def iter_dataset(name, columns=None, years=None, scenario=None, root=None, csv_file=None, batch_rows=500_000,
+                 interleave=False):
+    """
+    Chunked counterpart of `read_dataset`: yield the dataset as dataframes of at most
+    `batch_rows` rows, so that memory stays flat whatever the size of the dataset.
+    Chunks follow the partitions, one year after the other. With `interleave`, each chunk takes
+    an equal slice of every file instead, so that every chunk spans all the years
+    (the CSV fallback is still read in file order).
+    """
+    if not dataset_exists(name, root):
+        if csv_file is None:
+            raise FileNotFoundError(f"{name} not found in {store_path(root)}")
+        for chunk in pd.read_csv(csv_file, chunksize=batch_rows, parse_dates=["time"]):
+            if years is not None:
+                chunk = chunk[chunk["time"].dt.year.between(*years)]
+            yield to_store_schema(chunk if columns is None else chunk[list(columns)])
+        return
+
+    dataset = ds.dataset(store_path(root) / name, format="parquet", partitioning=PARTITIONING)
+    if columns is None:
+        columns = dataset_columns(name, root)
+
+    if interleave:
+        yield from _iter_interleaved(dataset, columns, _filter_expression(years, scenario), batch_rows)
+        return
+    for batch in dataset.to_batches(columns=columns, filter=_filter_expression(years, scenario), batch_size=batch_rows):
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def _iter_interleaved(dataset, columns, expression, batch_rows):
+    """Chunks made of the next batch of every file of the dataset, in turn, until all are read."""
+    fragments = list(dataset.get_fragments(filter=expression))
+    file_rows = max(1, batch_rows // max(1, len(fragments)))
+    readers = []
+    for fragment in fragments:
+        # Partition values are not stored in the files, they are added back as constant columns
+        keys = ds.get_partition_keys(fragment.partition_expression)
+        file_columns = [column for column in columns if column not in keys]
+        readers.append((pq.ParquetFile(fragment.path).iter_batches(batch_size=file_rows, columns=file_columns), keys))
+
+    while readers:
+        parts = []
+        for reader in list(readers):
+            batch = next(reader[0], None)
+            if batch is None:
+                readers.remove(reader)
+            elif batch.num_rows:
+                parts.append(batch.to_pandas().assign(**{key: value for key, value in reader[1].items() if key in columns}))
+        if parts:
+            yield pd.concat(parts, ignore_index=True)[list(columns)]
+
+
+def _filter_expression(years, scenario):
+    """Partition filter on an inclusive (first_year, last_year) range and on scenario names."""
+    filters = []
+    if years is not None:
+        first_year, last_year = years
+        filters.append((ds.field("year") >= first_year) & (ds.field("year") <= last_year))
+    if scenario is not None:
+        scenarios = [scenario] if isinstance(scenario, str) else list(scenario)
+        filters.append(ds.field("scenario").isin(scenarios))
+
+    expression = None
+    for condition in filters:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def _read_csv_fallback(csv_file, columns, years):
+    header = pd.read_csv(csv_file, nrows=0).columns
+    usecols = list(columns) if columns is not None else list(header)
+    if years is not None and "time" not in usecols:
+        usecols.append("time")
+    dataframe = pd.read_csv(
+        csv_file,
+        usecols=usecols,
+        parse_dates=["time"] if "time" in usecols else False,
+    )
+    if years is not None:
+        first_year, last_year = years
+        dataframe = dataframe[dataframe["time"].dt.year.between(first_year, last_year)]
+        if columns is not None and "time" not in columns:
+            dataframe = dataframe.drop(columns=["time"])
+    dataframe = to_store_schema(dataframe)
+    if columns is not None:
+        dataframe = dataframe[list(columns)]
+    return dataframe.reset_index(drop=True)
@@ -1,12 +1,17 @@
-import os
+import argparse
 import cdsapi
-from sklearn.model_selection import train_test_split
 
 from data_config import DataConfig, ProjectionRequest
-from data_proprocessing import load_data
-
-def download_flood_risk_data(client, dataset_name, request_params, save_path_template):
-    """Download flood risk data in chunks to avoid large requests."""
+from data_proprocessing import load_data, load_data_chunked, memory_report
+from blocked_cv import blocked_train_test_split, default_cv
+from data_store import read_dataset, save_dataset
+from feature_store import export_features
+from flood_ingestion import ingest_flood_risk, record_ingested
+from profiling import PROFILER, stage
+from download_manager import DownloadJob, DownloadManager, FakeClient
+
+def flood_risk_jobs(dataset_name, request_params, save_path_template):
+    """Download jobs for the flood risk data, in chunks to avoid large requests."""
     years_per_request = 1  # Adjust this number based on the API limitations
     years = request_params["hyear"]
 
@@ -17,49 +22,14 @@ def download_flood_risk_data(client, dataset_name, request_params, save_path_tem
 
         # Convert Path object to string before formatting
         save_path = str(save_path_template).format(start_year=chunk_years[0], end_year=chunk_years[-1])
+        yield DownloadJob(dataset_name, chunk_request, save_path)
 
-        if os.path.exists(save_path):
-            print(f"{dataset_name} data for years {chunk_years[0]}-{chunk_years[-1]} already exists.")
-        else:
-            print(f"Downloading {dataset_name} data for years {chunk_years[0]}-{chunk_years[-1]}...")
-            client.retrieve(dataset_name, chunk_request, save_path)
-            print(f"Download completed: {dataset_name} for years {chunk_years[0]}-{chunk_years[-1]}")
-
-if __name__ == "__main__":
-    if not DataConfig.DATA_PATH.exists():
-        DataConfig.DATA_PATH.mkdir()
+def download_flood_risk_data(manager, dataset_name, request_params, save_path_template):
+    """Download flood risk data in chunks to avoid large requests."""
+    return manager.run(flood_risk_jobs(dataset_name, request_params, save_path_template))
 
-    # Initialize CDS API client
-    client = cdsapi.Client()
-
-    # Function to download dataset if it doesn't exist
-    def download_dataset(dataset_name, request_params, save_path):
-        """Download dataset from Copernicus Climate Data Store if not already present."""
-        if os.path.exists(save_path):
-            print(f"{dataset_name} data already exists.")
-        else:
-            print(f"Downloading {dataset_name} data...")
-            client.retrieve(dataset_name, request_params, save_path)
-            print(f"Download completed: {dataset_name}")
-
-    ## Step 1: Download Precipitation Data
-    precipitation_target = DataConfig.DATA_PATH / "precipitation.zip"
-    download_dataset(
-        DataConfig.EXTREME_PRECIPITATION_DATASET,
-        DataConfig.EXTREME_PRECIPITATION_REQUEST,
-        precipitation_target
-    )
-
-    ## Step 2: Download Flood Risk Data (CEMS GLOFAS Historical)
-    flood_risk_target_template = DataConfig.DATA_PATH / "flood_risk_{start_year}_{end_year}.zip"
-    download_flood_risk_data(
-        client,
-        DataConfig.FLOOD_RISK_DATASET,
-        DataConfig.FLOOD_RISK_REQUEST,
-        flood_risk_target_template
-    )
-
-    ## Step 3: Download Climate Projections Data
+def projection_jobs():
+    """Download jobs for every (experiment, variable, model) of the climate projections."""
     for experiment in DataConfig.PROJECTIONS_EXPERIMENTS:
         period = (
             DataConfig.HISTORICAL_PERIOD
@@ -69,39 +39,129 @@ if __name__ == "__main__":
 
         for variable in DataConfig.PROJECTIONS_VARIABLES:
             for model in DataConfig.PROJECTIONS_MODELS:
-                projections_target = DataConfig.DATA_PATH / f"{experiment}_{variable}_{model}.zip"
-
-                if os.path.exists(projections_target):
-                    print(f"{experiment} {variable} {model} data already exists.")
-                    continue
-
                 projections_request = ProjectionRequest(
                     model, variable, experiment, period
                 ).get_request()
 
-                download_dataset(
+                yield DownloadJob(
                     DataConfig.PROJECTIONS_DATASET,
                     projections_request,
-                    projections_target
+                    DataConfig.DATA_PATH / f"{experiment}_{variable}_{model}.zip",
                 )
 
+# Legacy CSV exports of the scenarios, read by the experiments when the store has not been built
+SCENARIO_CSV_FILES = {"ssp1_2_6": "ssp1_df.csv", "ssp2_4_5": "ssp2_df.csv", "ssp5_8_5": "ssp5_df.csv"}
+
+def export_training_features():
+    """
+    Copy the training datasets to the memory-mapped feature store read by problem.py and the experiments.
+    X_train is laid out in the (fold, block) order of `problem.get_cv`, so each fold is a contiguous range.
+    """
+    order = default_cv().layout_order(read_dataset("X_train", columns=["time", "latitude", "longitude"]))
+    export_features("X_train", order=order)
+    for name in ["X_test", "flood_risk"]:
+        export_features(name)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download the raw datasets and build the processed store.")
+    parser.add_argument("--csv", action="store_true", help="Also export the processed datasets as CSV files.")
+    parser.add_argument("--chunked", action="store_true",
+                        help="Process the data a few years at a time, writing straight to the store.")
+    parser.add_argument("--lazy", action="store_true",
+                        help="Load the precipitation as a single lazy Dask graph (see DataConfig.LAZY_LOADING).")
+    parser.add_argument("--update-flood-risk", action="store_true",
+                        help="Only download the flood risk data and append the new files to the store.")
+    parser.add_argument("--memory-budget", type=float, default=None,
+                        help="Memory budget in MB used to pick the chunk size of --chunked.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of concurrent downloads (defaults to DataConfig.DOWNLOAD_WORKERS).")
+    parser.add_argument("--fake-client", action="store_true",
+                        help="Exercise the download scheduling with a local fake client, then stop.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Also write cProfile and tracemalloc snapshots of the slowest processing stage.")
+    args = parser.parse_args()
+    PROFILER.detailed = args.profile
+    DataConfig.LAZY_LOADING = DataConfig.LAZY_LOADING or args.lazy
+
+    if not DataConfig.DATA_PATH.exists():
+        DataConfig.DATA_PATH.mkdir()
+
+    # One CDS API client per download thread
+    client_factory = FakeClient if args.fake_client else cdsapi.Client
+    manager = DownloadManager(client_factory, max_workers=args.workers)
+
+    jobs = [
+        ## Step 1: Download Precipitation Data
+        DownloadJob(
+            DataConfig.EXTREME_PRECIPITATION_DATASET,
+            DataConfig.EXTREME_PRECIPITATION_REQUEST,
+            DataConfig.DATA_PATH / "precipitation.zip",
+        ),
+        ## Step 2: Download Flood Risk Data (CEMS GLOFAS Historical)
+        *flood_risk_jobs(
+            DataConfig.FLOOD_RISK_DATASET,
+            DataConfig.FLOOD_RISK_REQUEST,
+            DataConfig.DATA_PATH / "flood_risk_{start_year}_{end_year}.zip",
+        ),
+        ## Step 3: Download Climate Projections Data
+        *projection_jobs(),
+    ]
+    if args.update_flood_risk:
+        jobs = [job for job in jobs if job.dataset == DataConfig.FLOOD_RISK_DATASET]
+    failed = manager.run(jobs)
+    if failed:
+        raise SystemExit(f"❌ {len(failed)} download(s) failed: {', '.join(job.target.name for job in failed)}. "
+                         "Run the script again to resume.")
+    if args.fake_client:
+        print("✅ Fake downloads completed.")
+        raise SystemExit(0)
+
     print("✅ All datasets downloaded successfully.")
 
+    if args.update_flood_risk:
+        # Only the flood risk zips that are not in the store yet are decoded
+        ingest_flood_risk()
+        PROFILER.write_reports("download_data")
+        print("✅ Flood risk data updated.")
+        raise SystemExit(0)
+
     ## Step 4: Load and Save Dataframes
+    if args.chunked:
+        # Chunks are appended to the store as they are processed, nothing is held in memory
+        load_data_chunked(memory_budget_mb=args.memory_budget)
+        record_ingested()
+        with stage("export features"):
+            export_training_features()
+        PROFILER.write_reports("download_data")
+        print("✅ Data processing completed. All datasets saved to the store.")
+        raise SystemExit(0)
+
     print("Loading datasets into dataframes...", end="", flush=True)
-    train_df, ssp1_df, ssp2_df, ssp5_df, flood_risk_df = load_data()
+    train_df, projections_df, flood_risk_df = load_data()
+    memory_report({"train": train_df, "projections": projections_df, "flood_risk": flood_risk_df})
 
     print("Splitting and saving datasets...", end="", flush=True)
-    X_train, X_test = train_test_split(train_df, test_size=0.2, random_state=57, shuffle=True)
-
-    # Save datasets
-    X_train.to_csv(DataConfig.DATA_PATH / 'X_train.csv', index=False)
-    X_test.to_csv(DataConfig.DATA_PATH / 'X_test.csv', index=False)
-    ssp1_df.to_csv(DataConfig.DATA_PATH / 'ssp1_df.csv', index=False)
-    ssp2_df.to_csv(DataConfig.DATA_PATH / 'ssp2_df.csv', index=False)
-    ssp5_df.to_csv(DataConfig.DATA_PATH / 'ssp5_df.csv', index=False)
-
-    # Save flood risk data
-    flood_risk_df.to_csv(DataConfig.DATA_PATH / 'flood_risk_data.csv', index=False)
+    # Whole (year, tile) blocks go to either set, so neighbouring cells and months do not leak into the test set
+    X_train, X_test = blocked_train_test_split(train_df, test_size=0.2, random_state=DataConfig.SPLIT_RANDOM_STATE)
+
+    # Save datasets to the columnar store (and optionally to CSV)
+    def csv_file(file_name):
+        return DataConfig.DATA_PATH / file_name if args.csv else None
+
+    with stage("save datasets"):
+        save_dataset(X_train, "X_train", csv_file=csv_file('X_train.csv'))
+        save_dataset(X_test, "X_test", csv_file=csv_file('X_test.csv'))
+        # All scenarios in one write, partitioned by their scenario column
+        save_dataset(projections_df, "projections")
+        if args.csv:
+            for scenario, scenario_df in projections_df.groupby("scenario", observed=True):
+                scenario_df.drop(columns="scenario").to_csv(csv_file(SCENARIO_CSV_FILES[scenario]), index=False)
+
+        # Save flood risk data
+        save_dataset(flood_risk_df, "flood_risk", csv_file=csv_file('flood_risk_data.csv'))
+        record_ingested()
+    with stage("export features"):
+        export_training_features()
+    PROFILER.write_reports("download_data")
 
     print("✅ Data processing completed. All files saved successfully.")
@@ -0,0 +1,175 @@
+"""
+Concurrent, resumable downloads from the Copernicus Climate Data Store.
+
+Files are downloaded to `<target>.part` and atomically renamed once their zip archive
+has been checked, and every completed file is recorded in a manifest, so an interrupted
+run resumes where it stopped and a half-written file is never mistaken for a finished one.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from data_config import DataConfig
+
+
+class DownloadJob:
+    def __init__(self, dataset, request, target):
+        self.dataset = dataset
+        self.request = request
+        self.target = Path(target)
+
+    def request_hash(self):
+        content = json.dumps([self.dataset, self.request], sort_keys=True, default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def __repr__(self):
+        return f"DownloadJob({self.dataset!r}, target={str(self.target)!r})"
+
+
+def validate_zip(path):
+    """Whether `path` is a complete zip archive whose members all pass their CRC check."""
+    if not zipfile.is_zipfile(path):
+        return False
+    try:
+        with zipfile.ZipFile(path) as z:
+            return z.testzip() is None
+    except (zipfile.BadZipFile, OSError):
+        return False
+
+
+class DownloadManager:
+    """
+    Run download jobs on a bounded thread pool.
+
+    - `client_factory`: callable returning a client with a `retrieve(dataset, request, target)`
+      method, such as `cdsapi.Client`. Each worker thread gets its own client.
+    - `manifest_path`: JSON file recording the completed downloads.
+    """
+
+    def __init__(self, client_factory, max_workers=None, manifest_path=None, max_retries=2,
+                 validate=validate_zip):
+        self.client_factory = client_factory
+        self.max_workers = max_workers or DataConfig.DOWNLOAD_WORKERS
+        self.manifest_path = Path(manifest_path or DataConfig.DATA_PATH / "download_manifest.json")
+        self.max_retries = max_retries
+        self.validate = validate
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.manifest = {}
+        if self.manifest_path.exists():
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+
+    def _client(self):
+        if not hasattr(self._local, "client"):
+            self._local.client = self.client_factory()
+        return self._local.client
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _record(self, job):
+        with self._lock:
+            self.manifest[job.target.name] = {
+                "dataset": job.dataset,
+                "request": job.request_hash(),
+                "size": job.target.stat().st_size,
+                "completed": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            self._save_manifest()
+
+    def is_complete(self, job):
+        """
+        Whether a job's file is already downloaded. Files present on disk but missing from the
+        manifest (e.g. downloaded by an older version of the script) are adopted if they validate.
+        """
+        if not job.target.exists():
+            return False
+        entry = self.manifest.get(job.target.name)
+        if entry is not None:
+            return entry["request"] == job.request_hash() and entry["size"] == job.target.stat().st_size
+        if self.validate(job.target):
+            self._record(job)
+            return True
+        return False
+
+    def download(self, job):
+        """Download a single job to its `.part` file, check it and move it into place."""
+        part_path = job.target.with_name(job.target.name + ".part")
+        for attempt in range(1, self.max_retries + 2):
+            print(f"Downloading {job.dataset} to {job.target.name} (attempt {attempt})...")
+            try:
+                self._client().retrieve(job.dataset, job.request, str(part_path))
+                if not self.validate(part_path):
+                    raise IOError(f"{part_path} is not a valid zip archive")
+            except Exception as error:
+                print(f"Download of {job.target.name} failed: {error}")
+                part_path.unlink(missing_ok=True)
+                if attempt > self.max_retries:
+                    raise
+                continue
+            os.replace(part_path, job.target)
+            self._record(job)
+            print(f"Download completed: {job.target.name}")
+            return job
+
+    def run(self, jobs):
+        """
+        Download every job that is not complete yet, at most `max_workers` at a time.
+        Returns the list of jobs that failed after all their retries.
+        """
+        jobs = list(jobs)
+        pending = [job for job in jobs if not self.is_complete(job)]
+        for job in jobs:
+            if job not in pending:
+                print(f"{job.target.name} already downloaded.")
+        if not pending:
+            return []
+
+        for job in pending:
+            job.target.parent.mkdir(parents=True, exist_ok=True)
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.download, job): job for job in pending}
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    failed.append(futures[future])
+        return failed
+
+
+class FakeClient:
+    """
+    Local stand-in for `cdsapi.Client` that writes a small zip archive instead of downloading.
+    `fail_first` makes the first calls for each target raise, and `truncate` writes a
+    corrupt archive, to exercise the retry and validation paths without network access.
+    """
+
+    def __init__(self, fail_first=0, truncate=False, delay=0.0):
+        self.fail_first = fail_first
+        self.truncate = truncate
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def retrieve(self, dataset, request, target):
+        with self._lock:
+            self.calls.append((dataset, target))
+            attempts = sum(1 for _, called_target in self.calls if called_target == target)
+        time.sleep(self.delay)
+        if attempts <= self.fail_first:
+            raise ConnectionError(f"Simulated failure for {dataset}")
+
+        with zipfile.ZipFile(target, "w") as z:
+            z.writestr("request.json", json.dumps({"dataset": dataset, "request": request}, default=str))
+        if self.truncate:
+            with open(target, "r+b") as f:
+                f.truncate(os.path.getsize(target) // 2)
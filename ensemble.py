@@ -0,0 +1,174 @@
+"""
+Streaming reduction of a multi-model CMIP6 ensemble on the 1° x monthly grid.
+
+The projections of each model are folded into an `EnsembleAccumulator` as soon as they are
+decoded, then dropped: the accumulator keeps, per grid cell and variable, the running mean and
+sum of squared deviations (Welford's algorithm) and a small buffer of weighted values for the
+quantiles. Its memory is set by the size of the grid, whatever the number of models. Quantile
+buffers are exact up to `buffer_size` models; beyond, the two closest values of a cell are merged
+into their weighted mean, as `labelling.QuantileSketch` does, and quantiles are interpolated the
+same way.
+"""
+import numpy as np
+
+from data_config import DataConfig
+from data_store import save_dataset
+from grid_index import GRID_KEYS, GridIndex
+
+
+def ensemble_grid(years, margin=1):
+    """Grid of the configured Europe area over a list of consecutive years."""
+    north, west, south, east = DataConfig.FLOOD_RISK_REQUEST["area"]
+    return GridIndex((south - margin, north + margin), (west - margin, east + margin),
+                     (f"{years[0]}-01", f"{years[-1]}-12"))
+
+
+def quantile_column(variable, quantile):
+    """Name of a quantile column, e.g. `precipitation_q10` for the 10th percentile."""
+    return f"{variable}_q{round(quantile * 100):02d}"
+
+
+class EnsembleAccumulator:
+    """
+    Per-cell ensemble statistics of `variables`, updated one model at a time.
+
+    `result` gives the ensemble mean of every variable under its own name, the spread across
+    models (population standard deviation) as `{variable}_std` and each of `quantiles` as
+    `{variable}_qXX`. Ensembles of a single model only get the mean, so that their output is
+    the model's own projections.
+    """
+
+    def __init__(self, grid, variables, quantiles=None, buffer_size=None):
+        self.grid = grid
+        self.variables = list(variables)
+        self.quantiles = list(DataConfig.ENSEMBLE_QUANTILES if quantiles is None else quantiles)
+        self.buffer_size = buffer_size or DataConfig.ENSEMBLE_BUFFER_SIZE
+        self.models = []
+        self._count = {variable: np.zeros(grid.size, dtype=np.uint16) for variable in self.variables}
+        self._mean = {variable: np.zeros(grid.size) for variable in self.variables}
+        self._m2 = {variable: np.zeros(grid.size) for variable in self.variables}
+        # Quantile buffers, allocated once a second model comes in
+        self._values = {}
+        self._weights = {}
+
+    def update(self, dataframe, model=None):
+        """Fold the projections of one model, one row per grid cell, into the statistics."""
+        cells = self.grid.frame_cell_ids(dataframe)
+        if (cells < 0).any():
+            raise ValueError(f"{(cells < 0).sum()} rows of model {model} fall outside of {self.grid}")
+        self.models.append(model)
+
+        for variable in self.variables:
+            if variable not in dataframe:
+                continue
+            values = dataframe[variable].to_numpy(dtype=np.float64)
+            valid = ~np.isnan(values)
+            cell, value = cells[valid], values[valid]
+
+            count = self._count[variable]
+            if self.quantiles and len(self.models) > 1 and variable not in self._values:
+                self._allocate_buffers(variable)
+            count[cell] += 1
+            delta = value - self._mean[variable][cell]
+            self._mean[variable][cell] += delta / count[cell]
+            self._m2[variable][cell] += delta * (value - self._mean[variable][cell])
+            if variable in self._values:
+                self._buffer(variable, cell, value.astype(np.float32), count[cell])
+        return self
+
+    def _allocate_buffers(self, variable):
+        """Quantile buffers of a variable, holding the single value the cells had so far: their mean."""
+        values = np.full((self.grid.size, self.buffer_size), np.nan, dtype=np.float32)
+        weights = np.zeros((self.grid.size, self.buffer_size), dtype=np.float32)
+        seen = self._count[variable] > 0
+        values[seen, 0] = self._mean[variable][seen]
+        weights[seen, 0] = 1
+        self._values[variable], self._weights[variable] = values, weights
+
+    def _buffer(self, variable, cell, value, count):
+        values, weights = self._values[variable], self._weights[variable]
+        free = count <= self.buffer_size
+        values[cell[free], count[free] - 1] = value[free]
+        weights[cell[free], count[free] - 1] = 1
+
+        full = cell[~free]
+        if not len(full):
+            return
+        # Add the value to the full buffers, then merge the two closest values of each of them
+        cell_values = np.concatenate([values[full], value[~free, None]], axis=1)
+        cell_weights = np.concatenate([weights[full], np.ones((len(full), 1), dtype=np.float32)], axis=1)
+        order = np.argsort(cell_values, axis=1)
+        cell_values = np.take_along_axis(cell_values, order, axis=1)
+        cell_weights = np.take_along_axis(cell_weights, order, axis=1)
+
+        rows = np.arange(len(full))
+        closest = np.diff(cell_values, axis=1).argmin(axis=1)
+        merged_weights = cell_weights[rows, closest] + cell_weights[rows, closest + 1]
+        cell_values[rows, closest] = (
+            cell_values[rows, closest] * cell_weights[rows, closest]
+            + cell_values[rows, closest + 1] * cell_weights[rows, closest + 1]
+        ) / merged_weights
+        cell_weights[rows, closest] = merged_weights
+
+        keep = np.ones(cell_values.shape, dtype=bool)
+        keep[rows, closest + 1] = False
+        values[full] = cell_values[keep].reshape(len(full), self.buffer_size)
+        weights[full] = cell_weights[keep].reshape(len(full), self.buffer_size)
+
+    def _quantile(self, variable, cells, quantile):
+        """Quantile of the buffered values of cells, interpolated between the centres of their weights."""
+        values = self._values[variable][cells]
+        weights = self._weights[variable][cells]
+        # Empty slots hold NaN and sort last
+        order = np.argsort(values, axis=1)
+        values = np.take_along_axis(values, order, axis=1).astype(np.float64)
+        weights = np.take_along_axis(weights, order, axis=1).astype(np.float64)
+        used = (weights > 0).sum(axis=1)
+
+        centers = np.cumsum(weights, axis=1) - weights / 2
+        target = quantile * weights.sum(axis=1)
+        rows = np.arange(len(cells))
+        upper = np.minimum((centers < target[:, None]).sum(axis=1), np.maximum(used - 1, 0))
+        lower = np.maximum(upper - 1, 0)
+        span = centers[rows, upper] - centers[rows, lower]
+        fraction = np.clip(np.divide(target - centers[rows, lower], span,
+                                     out=np.zeros(len(cells)), where=span > 0), 0, 1)
+        result = values[rows, lower] + fraction * (values[rows, upper] - values[rows, lower])
+        return np.where(used > 0, result, np.nan)
+
+    def result(self):
+        """
+        Dataframe of the statistics on the cells where any variable has a value, sorted by cell
+        like `join_on_grid` output. Variables without a value in a cell are NaN.
+        """
+        present = np.flatnonzero(np.logical_or.reduce([count > 0 for count in self._count.values()]))
+        dataframe = self.grid.coordinates(present)
+        ensemble = len(self.models) > 1
+        for variable in self.variables:
+            count = self._count[variable][present]
+            has_value = count > 0
+            dataframe[variable] = np.where(has_value, self._mean[variable][present], np.nan).astype(
+                DataConfig.MEASUREMENT_DTYPE)
+            if not ensemble:
+                continue
+            variance = np.divide(self._m2[variable][present], count, out=np.full(len(present), np.nan), where=has_value)
+            dataframe[f"{variable}_std"] = np.sqrt(np.maximum(variance, 0)).astype(DataConfig.MEASUREMENT_DTYPE)
+            for quantile in self.quantiles:
+                dataframe[quantile_column(variable, quantile)] = self._quantile(
+                    variable, present, quantile).astype(DataConfig.MEASUREMENT_DTYPE)
+        return dataframe[GRID_KEYS + [column for column in dataframe.columns if column not in GRID_KEYS]]
+
+
+def reduce_ensemble(model_frames, grid, variables, experiment=None, append=False):
+    """
+    Ensemble statistics of `(model, dataframe)` pairs, consumed one at a time.
+    With `DataConfig.SAVE_PROJECTION_MEMBERS` each model's projections are also appended to the
+    `projection_members` dataset of the store, with a `model` column, under the experiment's scenario.
+    """
+    accumulator = EnsembleAccumulator(grid, variables)
+    for model, dataframe in model_frames:
+        if DataConfig.SAVE_PROJECTION_MEMBERS:
+            save_dataset(dataframe.assign(model=model), "projection_members", scenario=experiment,
+                         append=append or bool(accumulator.models))
+        accumulator.update(dataframe, model)
+    return accumulator.result()
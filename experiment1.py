@@ -1,114 +1,161 @@
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import classification_report
+from sklearn.metrics import accuracy_score, classification_report
 from sklearn.preprocessing import StandardScaler
-import joblib
-import os
+import argparse
 import gc
 
-# Function to load data from a specified path
-def load_data(file_path):
-    return pd.read_csv(file_path)
+from batch_scoring import score_scenarios
+from data_config import DataConfig
+from data_store import read_dataset
+from feature_store import features_exist, load_features
+from grid_index import GridCube, GridIndex
+from model_registry import ModelRegistry, data_fingerprint
+from profiling import PROFILER, stage
+from streaming_training import fit_model, fit_scaler, iter_training_chunks, predict_chunks
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--profile', action='store_true',
+                    help='Also write cProfile and tracemalloc snapshots of the slowest stage.')
+parser.add_argument('--streaming', action='store_true',
+                    help='Train out of core, on chunks of DataConfig.TRAINING_CHUNK_ROWS rows of the store.')
+args = parser.parse_args()
+PROFILER.detailed = args.profile
+
+# Function to load a dataset from the memory-mapped feature store or the columnar store,
+# falling back to its CSV export
+def load_data(name, file_path, columns=None, scenario=None):
+    if scenario is None and features_exist(name):
+        return load_features(name, columns=columns)
+    return read_dataset(name, columns=columns, scenario=scenario, csv_file=file_path)
 
 # Paths to the data files
 train_data_path = 'data/X_train.csv'
 test_data_path = 'data/X_test.csv'
-inference_data_paths = [
-    'data/ssp1_df.csv',
-    'data/ssp2_df.csv',
-    'data/ssp5_df.csv'
-]
+inference_data_paths = {
+    'ssp1_2_6': 'data/ssp1_df.csv',
+    'ssp2_4_5': 'data/ssp2_df.csv',
+    'ssp5_8_5': 'data/ssp5_df.csv',
+}
 
-# Load the training data
-train_df = load_data(train_data_path)
-test_df = load_data(test_data_path)
+# Optional region of interest for the risk summaries, as inclusive (min, max) ranges in degrees,
+# e.g. {'latitude': (43, 48), 'longitude': (5, 10)}
+region = None
 
 # Features and target
 features = ['longitude', 'latitude', 'air_temperature', 'precipitation']
-X_train = train_df[features]
-y_train = train_df['target']
 
-X_test = test_df[features]
-y_test = test_df['target']
+# The model and the scaler, trained unless the registry has them for this data, features and parameters
+model = RandomForestClassifier(n_estimators=100, random_state=42)
+scaler = StandardScaler()
+registry = ModelRegistry()
+training_data = [('X_train', features + ['target'], train_data_path), ('X_test', features + ['target'], test_data_path)]
+training = {'streaming': DataConfig.TRAINING_CHUNK_ROWS} if args.streaming else None
+model_key = registry.key(data_fingerprint(training_data), features, {'model': model, 'scaler': scaler}, training)
+registered = registry.load('experiment1', model_key)
+
+if registered is not None:
+    # Nothing of the training data is loaded
+    print("Loading the registered model and scaler...")
+    model, scaler = registered['model'], registered['scaler']
+elif args.streaming:
+    # The training set is read one chunk at a time: the scaler is fitted in a first pass,
+    # then the forest grows its trees chunk by chunk in a second one
+    def train_chunks():
+        return iter_training_chunks('X_train', features + ['target'], train_data_path)
+
+    with stage('fit scaler'):
+        classes, n_chunks = fit_scaler(scaler, train_chunks, features)
+
+    print(f"Training a new model on {n_chunks} chunk(s)...")
+    with stage('train model'):
+        fit_model(model, scaler, train_chunks, features, classes, n_chunks)
+
+    with stage('evaluate'):
+        y_test, y_pred = predict_chunks(
+            model, scaler, iter_training_chunks('X_test', features + ['target'], test_data_path), features)
+    print("Test Set Classification Report:")
+    print(classification_report(y_test, y_pred))
 
-X = pd.concat([X_train, X_test])
-y = pd.concat([y_train, y_test])
+    registry.save('experiment1', model_key, {'model': model, 'scaler': scaler},
+                  features=features, streaming=True, test_accuracy=accuracy_score(y_test, y_pred))
+    del y_test, y_pred
+    gc.collect()
+else:
+    # Load the training data, only reading the columns we need
+    with stage('load training data'):
+        train_df = load_data('X_train', train_data_path, columns=features + ['target'])
+        test_df = load_data('X_test', test_data_path, columns=features + ['target'])
 
-print("Training Data Summary:")
-print(X.info())
-print("\n")
-print("Target Distribution:")
-print(y.value_counts(normalize=True))
-print("\n")
+    X_train = train_df[features]
+    y_train = train_df['target']
 
-# Initialize the scaler
-scaler = StandardScaler()
+    X_test = test_df[features]
+    y_test = test_df['target']
 
-# Fit the scaler on the training data and transform both training and test data
-X_train_scaled = scaler.fit_transform(X_train)
-X_test_scaled = scaler.transform(X_test)
+    # Summaries of both splits, without concatenating them into a copy
+    print("Training Data Summary:")
+    X_train.info()
+    X_test.info()
+    print("\n")
+    print("Target Distribution:")
+    target_counts = y_train.value_counts().add(y_test.value_counts(), fill_value=0)
+    print(target_counts / target_counts.sum())
+    print("\n")
 
-# Check if the model is already trained and saved
-model_path = 'model_target1.pkl'
-scaler_path = 'scaler_target1.pkl'
+    # Fit the scaler on the training data and transform both training and test data
+    with stage('fit scaler', rows_in=len(X_train)):
+        X_train_scaled = scaler.fit_transform(X_train)
+        X_test_scaled = scaler.transform(X_test)
 
-if os.path.exists(model_path) and os.path.exists(scaler_path):
-    del X, y, X_train, y_train, X_train_scaled, X_test_scaled
-    gc.collect()
-    print("Loading existing model and scaler...")
-    model = joblib.load(model_path)
-    scaler = joblib.load(scaler_path)
-else:
     print("Training a new model...")
-    # Train a Random Forest Classifier
-    model = RandomForestClassifier(n_estimators=100, random_state=42)
-
     # Fit the model on the scaled training data
-    model.fit(X_train_scaled, y_train)
+    with stage('train model', rows_in=len(X_train_scaled)):
+        model.fit(X_train_scaled, y_train)
 
     # Evaluate the model on the scaled test data
-    y_pred = model.predict(X_test_scaled)
+    with stage('evaluate', rows_in=len(X_test_scaled)):
+        y_pred = model.predict(X_test_scaled)
     print("Test Set Classification Report:")
     print(classification_report(y_test, y_pred))
 
-    # Save the model and scaler
-    joblib.dump(model, model_path)
-    joblib.dump(scaler, scaler_path)
-    del X, y, X_train, y_train, X_test, y_test, X_train_scaled, X_test_scaled
+    # Register the model and scaler
+    registry.save('experiment1', model_key, {'model': model, 'scaler': scaler},
+                  features=features, test_accuracy=accuracy_score(y_test, y_pred))
+    del train_df, test_df, X_train, y_train, X_test, y_test, X_train_scaled, X_test_scaled
     gc.collect()
 
-# Process each inference dataset separately to manage memory
-for i, path in enumerate(inference_data_paths, start=1):
-    print(f"Processing Inference Dataset {i}...")
-    df = load_data(path)
-
-    # Prepare the features for inference
-    X_new = df[features]
-
-    # Scale the features
-    X_new_scaled = scaler.transform(X_new)
-
-    # Make predictions
-    df['predicted_target'] = model.predict(X_new_scaled)
-
-    # Save the new predictions
-    output_path = f'{path}_target_predictions.csv'
-    df.to_csv(output_path, index=False)
-    print(f"Predictions saved to {output_path}\n")
-
+# Score the inference datasets chunk by chunk, all scenarios at once
+print("Processing Inference Datasets...")
+with stage('score scenarios'):
+    summaries = score_scenarios(
+        model, scaler, inference_data_paths, features,
+        output_template='data/predictions/target_predictions_{scenario}.parquet',
+        prediction_column='predicted_target',
+    )
+
+for i, (scenario, summary) in enumerate(summaries.items(), start=1):
+    print(f"Predictions saved to data/predictions/target_predictions_{scenario}.parquet")
     # Analyze the results
     print(f"Inference Dataset {i} - Target Analysis:")
-    print(df['predicted_target'].value_counts(normalize=True))
+    print(summary.class_distribution())
     print("\n")
 
-# Compare the overall target predictions across the datasets
-overall_targets = []
-for i, path in enumerate(inference_data_paths, start=1):
-    df = load_data(f'{path}_target_predictions.csv')
-    overall_targets.append(df['predicted_target'].value_counts(normalize=True))
-
 print("Overall Target Predictions for Each Lifestyle Hypothesis:")
-for i, target_dist in enumerate(overall_targets, start=1):
+for i, summary in enumerate(summaries.values(), start=1):
     print(f"Lifestyle Hypothesis {i}:")
-    print(target_dist)
+    print(summary.class_distribution())
+
+# Regional summary, sliced out of the grid cube of each scenario's predictions
+if region is not None:
+    grid = GridIndex.from_config()
+    for scenario in summaries:
+        predictions = pd.read_parquet(
+            f'data/predictions/target_predictions_{scenario}.parquet',
+            columns=['time', 'latitude', 'longitude', 'predicted_target'],
+        )
+        cube = GridCube.from_frame(predictions, index=grid).select(**region)
+        print(f"{scenario} - mean predicted_target over {region}: {cube.mean('predicted_target'):.4f}")
+
+PROFILER.write_reports('experiment1')
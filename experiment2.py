@@ -1,113 +1,139 @@
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import classification_report
+from sklearn.metrics import accuracy_score, classification_report
 from sklearn.preprocessing import StandardScaler
-import joblib
-import os
+import argparse
 import gc
 
-# Function to load data from a specified path
-def load_data(file_path):
-    return pd.read_csv(file_path)
+from batch_scoring import score_scenarios
+from data_store import read_dataset
+from feature_store import features_exist, load_features
+from grid_index import GridCube, GridIndex
+from model_registry import ModelRegistry, data_fingerprint
+from profiling import PROFILER, stage
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--profile', action='store_true',
+                    help='Also write cProfile and tracemalloc snapshots of the slowest stage.')
+args = parser.parse_args()
+PROFILER.detailed = args.profile
+
+# Function to load a dataset from the memory-mapped feature store or the columnar store,
+# falling back to its CSV export
+def load_data(name, file_path, columns=None, scenario=None):
+    if scenario is None and features_exist(name):
+        return load_features(name, columns=columns)
+    return read_dataset(name, columns=columns, scenario=scenario, csv_file=file_path)
 
 # Paths to the data files
 train_data_path = 'data/flood_risk_data.csv'  # Replace with your actual file path
-inference_data_paths = [
-    'data/ssp1_df.csv',  # Replace with your actual file path
-    'data/ssp2_df.csv',  # Replace with your actual file path
-    'data/ssp5_df.csv'   # Replace with your actual file path
-]
+inference_data_paths = {
+    'ssp1_2_6': 'data/ssp1_df.csv',  # Replace with your actual file path
+    'ssp2_4_5': 'data/ssp2_df.csv',  # Replace with your actual file path
+    'ssp5_8_5': 'data/ssp5_df.csv',  # Replace with your actual file path
+}
 
-# Load the training data
-train_df = load_data(train_data_path)
-
-# Convert target to categorical levels
-train_df['target_category'] = pd.qcut(train_df['target'], q=4, labels=False)
+# Optional region of interest for the risk summaries, as inclusive (min, max) ranges in degrees,
+# e.g. {'latitude': (43, 48), 'longitude': (5, 10)}
+region = None
 
 # Features and target
 features = ['longitude', 'latitude', 'Runoff', 'SnowDepth']
-X = train_df[features]
-y = train_df['target_category']
 
-print("Training Data Summary:")
-print(X.info())
-print("\n")
-print("Target Distribution:")
-print(y.value_counts(normalize=True))
-print("\n")
+# The model and the scaler, trained unless the registry has them for this data, features and parameters
+model = RandomForestClassifier(n_estimators=100)
+scaler = StandardScaler()
+split = {'test_size': 0.2, 'random_state': 42, 'target_quantiles': 4}
+registry = ModelRegistry()
+training_data = [('flood_risk', features + ['target'], train_data_path)]
+model_key = registry.key(data_fingerprint(training_data), features, {'model': model, 'scaler': scaler}, split)
+registered = registry.load('experiment2', model_key)
+
+if registered is not None:
+    # Nothing of the training data is loaded
+    print("Loading the registered model and scaler...")
+    model, scaler = registered['model'], registered['scaler']
+else:
+    # Load the training data, only reading the columns we need
+    with stage('load training data'):
+        train_df = load_data('flood_risk', train_data_path, columns=features + ['target'])
 
-# Split the data into training and test sets
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, stratify=y, random_state=42)
+    # Convert target to categorical levels
+    train_df['target_category'] = pd.qcut(train_df['target'], q=split['target_quantiles'], labels=False)
 
-# Initialize the scaler
-scaler = StandardScaler()
+    X = train_df[features]
+    y = train_df['target_category']
 
-# Fit the scaler on the training data and transform both training and test data
-X_train_scaled = scaler.fit_transform(X_train)
-X_test_scaled = scaler.transform(X_test)
+    print("Training Data Summary:")
+    print(X.info())
+    print("\n")
+    print("Target Distribution:")
+    print(y.value_counts(normalize=True))
+    print("\n")
 
-# Check if the model is already trained and saved
-model_path = 'model2.pkl'
-scaler_path = 'scaler2.pkl'
+    # Split the data into training and test sets
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=split['test_size'], stratify=y, random_state=split['random_state'])
 
-if os.path.exists(model_path) and os.path.exists(scaler_path):
-    del X, y, X_train, y_train, X_train_scaled, X_test_scaled
-    gc.collect()
-    print("Loading existing model and scaler...")
-    model = joblib.load(model_path)
-    scaler = joblib.load(scaler_path)
-else:
-    print("Training a new model...")
-    # Train a Random Forest Classifier
-    model = RandomForestClassifier(n_estimators=100)
+    # Fit the scaler on the training data and transform both training and test data
+    with stage('fit scaler', rows_in=len(X_train)):
+        X_train_scaled = scaler.fit_transform(X_train)
+        X_test_scaled = scaler.transform(X_test)
 
+    print("Training a new model...")
     # Fit the model on the scaled training data
-    model.fit(X_train_scaled, y_train)
+    with stage('train model', rows_in=len(X_train_scaled)):
+        model.fit(X_train_scaled, y_train)
 
     # Evaluate the model on the scaled test data
-    y_pred = model.predict(X_test_scaled)
+    with stage('evaluate', rows_in=len(X_test_scaled)):
+        y_pred = model.predict(X_test_scaled)
     print("Test Set Classification Report:")
     print(classification_report(y_test, y_pred))
 
-    # Save the model and scaler
-    joblib.dump(model, model_path)
-    joblib.dump(scaler, scaler_path)
-    del X, y, X_train, y_train, X_test, y_test, X_train_scaled, X_test_scaled
+    # Register the model and scaler
+    registry.save('experiment2', model_key, {'model': model, 'scaler': scaler},
+                  features=features, test_accuracy=accuracy_score(y_test, y_pred))
+    del train_df, X, y, X_train, y_train, X_test, y_test, X_train_scaled, X_test_scaled
     gc.collect()
 
-# Process each inference dataset separately to manage memory
-for i, path in enumerate(inference_data_paths, start=1):
-    print(f"Processing Inference Dataset {i}...")
-    df = load_data(path)
-
-    # Prepare the features for inference
+# Prepare the features for inference
+def prepare_features(df):
     df['Runoff'] = df['total_runoff'].fillna(0)  # Assuming missing values are filled with 0
     df['SnowDepth'] = df['snowfall_flux']  # Assuming snowfall_flux is equivalent to SnowDepth
-
-    # Scale the features
-    X_new = df[features]
-    X_new_scaled = scaler.transform(X_new)
-
-    # Make predictions
-    df['predicted_target_category'] = model.predict(X_new_scaled)
-
-    # Save the new predictions
-    output_path = f'{path}_predictions.csv'
-    df.to_csv(output_path, index=False)
-    print(f"Predictions saved to {output_path}\n")
-
+    return df
+
+# Score the inference datasets chunk by chunk, all scenarios at once
+print("Processing Inference Datasets...")
+with stage('score scenarios'):
+    summaries = score_scenarios(
+        model, scaler, inference_data_paths, features,
+        output_template='data/predictions/flood_risk_predictions_{scenario}.parquet',
+        prepare=prepare_features,
+        prediction_column='predicted_target_category',
+    )
+
+for i, (scenario, summary) in enumerate(summaries.items(), start=1):
+    print(f"Predictions saved to data/predictions/flood_risk_predictions_{scenario}.parquet")
     # Analyze the results
     print(f"Inference Dataset {i} - Flood Risk Analysis:")
-    print(df['predicted_target_category'].value_counts(normalize=True))
+    print(summary.class_distribution())
     print("\n")
 
-# Compare the overall flood risks across the datasets
-overall_risks = []
-for i, path in enumerate(inference_data_paths, start=1):
-    df = load_data(f'{path}_predictions.csv')
-    overall_risks.append(df['predicted_target_category'].mean())
-
 print("Overall Flood Risks for Each Lifestyle Hypothesis:")
-for i, risk in enumerate(overall_risks, start=1):
-    print(f"Lifestyle Hypothesis {i}: {risk:.4f}")
+for i, summary in enumerate(summaries.values(), start=1):
+    print(f"Lifestyle Hypothesis {i}: {summary.mean_risk():.4f}")
+
+# Regional summary, sliced out of the grid cube of each scenario's predictions
+if region is not None:
+    grid = GridIndex.from_config()
+    for scenario in summaries:
+        predictions = pd.read_parquet(
+            f'data/predictions/flood_risk_predictions_{scenario}.parquet',
+            columns=['time', 'latitude', 'longitude', 'predicted_target_category'],
+        )
+        cube = GridCube.from_frame(predictions, index=grid).select(**region)
+        print(f"{scenario} - mean predicted_target_category over {region}: {cube.mean('predicted_target_category'):.4f}")
+
+PROFILER.write_reports('experiment2')
@@ -0,0 +1,145 @@
+"""
+Memory-mapped feature store of the training datasets.
+
+Each dataset is a directory `data/features/<name>/` holding one fixed-width `.npy` array per
+column and a `meta.json` sidecar with the row count and the column order and dtypes.
+Loading maps the arrays read-only instead of parsing them, so `load_features` returns
+zero-copy views, starts instantly whatever the size of the data, and every process reading
+the same dataset shares the operating system's page cache.
+"""
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+from numpy.lib.format import open_memmap
+
+from data_config import DataConfig
+from data_store import PARTITIONING, dataset_columns, iter_dataset, read_dataset, store_path
+
+META_FILE = "meta.json"
+
+
+def features_path(root=None):
+    """Directory holding the feature store, `data/features` by default."""
+    root = DataConfig.DATA_PATH if root is None else Path(root)
+    return root / "features"
+
+
+def _fixed_width(series):
+    """Values of a column as a fixed-width array, strings included, so that it can be memory-mapped."""
+    if series.dtype.kind in "biufcM":
+        return series.to_numpy()
+    return series.to_numpy(dtype=str)
+
+
+def _write(dataset_path, rows, write_columns):
+    """
+    Write a dataset next to its final location and move it into place once complete,
+    so a reader never maps a half-written dataset.
+    """
+    tmp_path = dataset_path.with_name(dataset_path.name + ".tmp")
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir(parents=True)
+
+    meta_columns = write_columns(tmp_path)
+    with open(tmp_path / META_FILE, "w") as f:
+        json.dump({
+            "rows": rows,
+            "columns": meta_columns,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }, f, indent=1)
+
+    if dataset_path.exists():
+        shutil.rmtree(dataset_path)
+    os.replace(tmp_path, dataset_path)
+
+
+def save_features(dataframe, name, root=None):
+    """Write an in-memory dataframe to the feature store, replacing the dataset if it exists."""
+    def write_columns(path):
+        meta_columns = []
+        for i, column in enumerate(dataframe.columns):
+            values = _fixed_width(dataframe[column])
+            np.save(path / f"{i}.npy", values)
+            meta_columns.append({"name": column, "dtype": values.dtype.str, "file": f"{i}.npy"})
+        return meta_columns
+
+    _write(features_path(root) / name, len(dataframe), write_columns)
+
+
+def export_features(name, root=None, order=None, batch_rows=500_000):
+    """
+    Copy a dataset of the columnar store to the feature store in batches,
+    writing straight into the memory-mapped arrays so memory stays flat.
+    `order` optionally permutes the rows; the dataset is then copied one column at a time.
+    String columns are not supported here, use `save_features` for them.
+    """
+    columns = dataset_columns(name, root)
+    rows = ds.dataset(store_path(root) / name, format="parquet", partitioning=PARTITIONING).count_rows()
+    if not rows:
+        return save_features(read_dataset(name, root=root), name, root)
+
+    if order is not None:
+        def write_columns(path):
+            meta_columns = []
+            for i, column in enumerate(columns):
+                values = read_dataset(name, columns=[column], root=root)[column].to_numpy()[order]
+                np.save(path / f"{i}.npy", values)
+                meta_columns.append({"name": column, "dtype": values.dtype.str, "file": f"{i}.npy"})
+            return meta_columns
+
+        return _write(features_path(root) / name, rows, write_columns)
+
+    def write_columns(path):
+        arrays = None
+        start = 0
+        for chunk in iter_dataset(name, columns=columns, root=root, batch_rows=batch_rows):
+            if arrays is None:
+                arrays = [
+                    open_memmap(path / f"{i}.npy", mode="w+", dtype=chunk[column].dtype, shape=(rows,))
+                    for i, column in enumerate(columns)
+                ]
+            for array, column in zip(arrays, columns):
+                array[start:start + len(chunk)] = chunk[column].to_numpy()
+            start += len(chunk)
+
+        meta_columns = []
+        for i, (array, column) in enumerate(zip(arrays, columns)):
+            array.flush()
+            meta_columns.append({"name": column, "dtype": array.dtype.str, "file": f"{i}.npy"})
+        return meta_columns
+
+    _write(features_path(root) / name, rows, write_columns)
+
+
+def features_exist(name, root=None):
+    return (features_path(root) / name / META_FILE).exists()
+
+
+def load_features(name, columns=None, root=None):
+    """
+    Dataframe of read-only, memory-mapped views of a dataset's columns.
+    Only the requested columns are mapped, all of them if `columns` is None.
+    """
+    dataset_path = features_path(root) / name
+    with open(dataset_path / META_FILE) as f:
+        meta = json.load(f)
+
+    files = {column["name"]: column["file"] for column in meta["columns"]}
+    if columns is None:
+        columns = list(files)
+    missing = [column for column in columns if column not in files]
+    if missing:
+        raise KeyError(f"Columns {missing} not in the feature store dataset {name}")
+
+    return pd.DataFrame(
+        # Plain ndarray views of the maps, which the views keep open
+        {column: np.asarray(np.load(dataset_path / files[column], mmap_mode="r")) for column in columns},
+        copy=False,
+    )
@@ -0,0 +1,150 @@
+"""
+Incremental ingestion of new GloFAS flood risk data into the store.
+
+A full build decodes every yearly zip of `DataConfig.FLOOD_DATA_PERIOD` and rewrites the whole
+`flood_risk` dataset. To keep it current, `ingest_flood_risk` only decodes the zips that are not
+in the dataset yet, yearly (`flood_risk_2025_2025.zip`) or monthly (`flood_risk_2025_03.zip`),
+and appends their rows to the year partitions of the store. A manifest stored with the Parquet
+files, `store/flood_risk/_ingested.json`, records the content hash of every zip in the dataset,
+so unchanged zips are skipped. Months already in the store, e.g. from a zip downloaded again
+with corrected data, are replaced rather than duplicated: only their year partitions are rewritten.
+
+The manifest lives inside the dataset, so a full build, which replaces the dataset, also resets
+it; the build then records the zips it read with `record_ingested`.
+
+Usage:
+    python flood_ingestion.py [ZIP ...]
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from build_cache import BuildCache
+from data_config import DataConfig
+from data_proprocessing import build_units, flood_risk_units
+from data_store import dataset_exists, read_dataset, save_dataset, store_path, to_store_schema
+from feature_store import export_features, features_exist
+from grid_index import GRID_KEYS
+from profiling import stage
+
+# Files starting with "_" are not part of a pyarrow dataset
+MANIFEST_FILE = "_ingested.json"
+
+
+def manifest_path(root=None):
+    return store_path(root) / "flood_risk" / MANIFEST_FILE
+
+
+def read_manifest(root=None):
+    """Zips making up the flood risk dataset, by file name."""
+    path = manifest_path(root)
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, root=None):
+    path = manifest_path(root)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def record_ingested(zip_paths=None, root=None, rows=None):
+    """
+    Add zips to the manifest of the flood risk dataset, by default the yearly zips of
+    `DataConfig.FLOOD_DATA_PERIOD` read by a full build. `rows` optionally gives their row counts.
+    """
+    data_path = DataConfig.DATA_PATH if root is None else Path(root)
+    if zip_paths is None:
+        zip_paths = [data_path / f"flood_risk_{year}_{year}.zip" for year in DataConfig.FLOOD_DATA_PERIOD]
+    hasher = BuildCache(root, enabled=True)
+    manifest = read_manifest(root)
+    for i, zip_path in enumerate(zip_paths):
+        manifest[Path(zip_path).name] = {
+            "sha256": hasher.file_hash(zip_path),
+            "rows": None if rows is None else int(rows[i]),
+            "ingested": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+    write_manifest(manifest, root)
+
+
+def pending_zips(zip_paths, root=None):
+    """The zips missing from the flood risk dataset, or whose content changed since they were ingested."""
+    hasher = BuildCache(root, enabled=True)
+    manifest = read_manifest(root)
+    return [
+        Path(zip_path) for zip_path in zip_paths
+        if manifest.get(Path(zip_path).name, {}).get("sha256") != hasher.file_hash(zip_path)
+    ]
+
+
+def ingest_flood_risk(zip_paths=None, root=None):
+    """
+    Append the flood risk zips that are not in the store yet. `zip_paths` defaults to every
+    `flood_risk_*.zip` of the data directory. The feature store copy of the dataset, if any,
+    is exported again. Returns the number of rows ingested.
+    """
+    data_path = DataConfig.DATA_PATH if root is None else Path(root)
+    if zip_paths is None:
+        zip_paths = sorted(data_path.glob("flood_risk_*.zip"))
+    new_zips = pending_zips(zip_paths, root)
+    if not new_zips:
+        print("Flood risk data is up to date.")
+        return 0
+
+    with stage("ingest flood risk") as record:
+        cache = BuildCache(root)
+        frames = [frame.dropna() for frame in build_units(cache, "flood_risk", flood_risk_units(cache, new_zips))]
+        # Later zips win where new zips overlap, e.g. a monthly update of a yearly zip
+        flood_risk_df = to_store_schema(pd.concat(frames)).drop_duplicates(GRID_KEYS, keep="last")
+        record.rows_in = len(flood_risk_df)
+
+        # Stored months the new data covers are replaced: their year partitions are rewritten
+        months = flood_risk_df["time"].unique()
+        replaced_files = []
+        replaced_rows = 0
+        if dataset_exists("flood_risk", root):
+            years = flood_risk_df["time"].dt.year
+            stored_times = read_dataset("flood_risk", columns=["time"], years=(int(years.min()), int(years.max())),
+                                        root=root)["time"]
+            for year in sorted(stored_times[stored_times.isin(months)].dt.year.unique()):
+                stored_df = read_dataset("flood_risk", years=(int(year), int(year)), root=root)
+                replaced_files += (store_path(root) / "flood_risk").glob(f"*/year={year}/*.parquet")
+                replaced_rows += int(stored_df["time"].isin(months).sum())
+                flood_risk_df = pd.concat([stored_df[~stored_df["time"].isin(months)], flood_risk_df])
+
+        # The old files of the rewritten partitions are removed once the new ones are written
+        save_dataset(flood_risk_df, "flood_risk", root=root, append=True)
+        for path in replaced_files:
+            path.unlink()
+        record_ingested(new_zips, root, rows=[len(frame) for frame in frames])
+        record.rows_out = sum(len(frame) for frame in frames)
+
+    print(f"Ingested {len(new_zips)} flood risk file(s): {record.rows_out} rows, "
+          f"{replaced_rows} stored rows replaced.")
+    if features_exist("flood_risk", root):
+        with stage("export flood risk features"):
+            export_features("flood_risk", root)
+    return record.rows_out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append new flood risk zips to the store.")
+    parser.add_argument("zips", nargs="*", type=Path,
+                        help="Zips to ingest (defaults to every flood_risk_*.zip of the data directory).")
+    parser.add_argument("--root", default=None, help="Data directory (defaults to DataConfig.DATA_PATH).")
+    args = parser.parse_args()
+
+    ingest_flood_risk(args.zips or None, args.root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Dense integer index of the 1° x monthly grid shared by the processed datasets.
+
+After coarsening, every dataset lives on whole-degree latitudes and longitudes and month-start
+times. `GridIndex` maps a (time, latitude, longitude) point to a dense integer cell id with
+arithmetic only, so joins and filters work on integers rather than on float and datetime keys.
+`GridCube` holds a dataset as dense (month, latitude, longitude) arrays with a validity mask,
+so point, bounding-box and time-range queries are array lookups and slices instead of scans.
+"""
+import numpy as np
+import pandas as pd
+
+from data_config import DataConfig
+
+GRID_KEYS = ["time", "latitude", "longitude"]
+
+
+def _month_numbers(times):
+    """Months since 1970-01 of datetime-like values."""
+    times = np.asarray(times)
+    if times.dtype.kind != "M":
+        times = pd.to_datetime(times).to_numpy()
+    return times.astype("datetime64[M]").astype(np.int64)
+
+
+def _degrees(values):
+    """Whole degrees of coordinates, rounding the float ones."""
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        values = np.rint(values)
+    return values.astype(np.int64)
+
+
+def _month(value):
+    """Month number of a single date, e.g. '2010-05' or a Timestamp."""
+    return int(np.datetime64(pd.Timestamp(value), "M").astype(np.int64))
+
+
+class GridIndex:
+    """
+    Regular grid over inclusive (first, last) whole-degree latitude and longitude ranges
+    and an inclusive (first, last) month range, e.g. `("2000-01", "2030-12")`.
+    Cell ids run over months first, then latitudes, then longitudes, which is the
+    (time, latitude, longitude) order of the processed datasets.
+    """
+
+    def __init__(self, latitudes, longitudes, months):
+        self.latitudes = (int(latitudes[0]), int(latitudes[1]))
+        self.longitudes = (int(longitudes[0]), int(longitudes[1]))
+        self.months = (_month(months[0]), _month(months[1]))
+        self.shape = (
+            self.months[1] - self.months[0] + 1,
+            self.latitudes[1] - self.latitudes[0] + 1,
+            self.longitudes[1] - self.longitudes[0] + 1,
+        )
+        self.size = int(np.prod(self.shape))
+        self.id_dtype = np.int32 if self.size < np.iinfo(np.int32).max else np.int64
+
+    @classmethod
+    def from_config(cls, margin=1):
+        """Grid of the configured Europe area, widened by `margin` degrees, over all the configured periods."""
+        north, west, south, east = DataConfig.FLOOD_RISK_REQUEST["area"]
+        years = [int(year) for year in DataConfig.HISTORICAL_PERIOD + DataConfig.PROJECTIONS_PERIOD
+                 + DataConfig.FLOOD_DATA_PERIOD]
+        return cls((south - margin, north + margin), (west - margin, east + margin),
+                   (f"{min(years)}-01", f"{max(years)}-12"))
+
+    @classmethod
+    def from_frames(cls, frames):
+        """Smallest grid holding every row of the given dataframes."""
+        frames = [frame for frame in frames if len(frame)]
+        bounds = [
+            (min(frame[key].min() for frame in frames), max(frame[key].max() for frame in frames))
+            for key in GRID_KEYS
+        ]
+        months, latitudes, longitudes = bounds
+        return cls(np.rint(latitudes), np.rint(longitudes), months)
+
+    def __repr__(self):
+        first, last = (np.datetime64(month, "M") for month in self.months)
+        return (f"GridIndex(latitudes={self.latitudes}, longitudes={self.longitudes}, "
+                f"months=('{first}', '{last}'), shape={self.shape})")
+
+    def positions(self, time, latitude, longitude):
+        """Month, latitude and longitude positions of points, possibly outside of the grid."""
+        return (
+            _month_numbers(time) - self.months[0],
+            _degrees(latitude) - self.latitudes[0],
+            _degrees(longitude) - self.longitudes[0],
+        )
+
+    def cell_ids(self, time, latitude, longitude):
+        """Cell id of every point, -1 for the points outside of the grid."""
+        positions = self.positions(time, latitude, longitude)
+        inside = np.ones(len(positions[0]), dtype=bool)
+        for position, length in zip(positions, self.shape):
+            inside &= (position >= 0) & (position < length)
+        month, lat, lon = positions
+        ids = (month * self.shape[1] + lat) * self.shape[2] + lon
+        return np.where(inside, ids, -1).astype(self.id_dtype)
+
+    def frame_cell_ids(self, dataframe):
+        return self.cell_ids(dataframe["time"], dataframe["latitude"], dataframe["longitude"])
+
+    def cell_id(self, time, latitude, longitude):
+        """Cell id of a single point, raises KeyError when it is outside of the grid."""
+        cell = int(self.cell_ids([time], [latitude], [longitude])[0])
+        if cell < 0:
+            raise KeyError(f"({time}, {latitude}, {longitude}) is outside of {self}")
+        return cell
+
+    def coordinates(self, cell_ids):
+        """(time, latitude, longitude) columns of cell ids, in the dtypes of `DataConfig`."""
+        cell_ids = np.asarray(cell_ids, dtype=np.int64)
+        month, remainder = np.divmod(cell_ids, self.shape[1] * self.shape[2])
+        lat, lon = np.divmod(remainder, self.shape[2])
+        return pd.DataFrame({
+            "time": (month + self.months[0]).astype("datetime64[M]").astype(DataConfig.TIME_DTYPE),
+            "latitude": (lat + self.latitudes[0]).astype(DataConfig.COORDINATE_DTYPES["latitude"]),
+            "longitude": (lon + self.longitudes[0]).astype(DataConfig.COORDINATE_DTYPES["longitude"]),
+        })
+
+    def slices(self, time=None, latitude=None, longitude=None):
+        """
+        Array slices along (month, latitude, longitude) of inclusive (first, last) ranges.
+        A range left to None keeps the whole axis.
+        """
+        time = None if time is None else (_month(time[0]), _month(time[1]))
+        slices = []
+        for bounds, (first, last) in zip([time, latitude, longitude], [self.months, self.latitudes, self.longitudes]):
+            if bounds is None:
+                slices.append(slice(None))
+            else:
+                start = max(int(np.ceil(bounds[0])), first) - first
+                stop = min(int(np.floor(bounds[1])), last) - first + 1
+                slices.append(slice(start, max(stop, start)))
+        return tuple(slices)
+
+    def subgrid(self, time=None, latitude=None, longitude=None):
+        """Index of the part of the grid selected by `slices`."""
+        bounds = []
+        for axis_slice, (first, _), length in zip(self.slices(time, latitude, longitude),
+                                                  [self.months, self.latitudes, self.longitudes], self.shape):
+            start, stop, _ = axis_slice.indices(length)
+            bounds.append((first + start, first + stop - 1))
+        months, latitudes, longitudes = bounds
+        return GridIndex(latitudes, longitudes, tuple(np.datetime64(month, "M") for month in months))
+
+    def join(self, frames, how="outer"):
+        """
+        Join dataframes with at most one row per grid cell on their cell ids.
+        `how="outer"` keeps the cells of any frame and fills the gaps with NaN,
+        `how="inner"` only keeps the cells present in every frame.
+        Rows come out in cell id order, i.e. sorted by (time, latitude, longitude).
+        """
+        frames = list(frames)
+        frame_ids = [self.frame_cell_ids(frame) for frame in frames]
+        if any((ids < 0).any() for ids in frame_ids):
+            raise ValueError(f"Rows outside of {self}")
+
+        # Number of frames holding each cell, then the output row of each kept cell
+        counts = np.zeros(self.size, dtype=np.int16)
+        for ids in frame_ids:
+            counts[ids] += 1
+        kept = counts > 0 if how == "outer" else counts == len(frames)
+        cells = np.flatnonzero(kept)
+        row_of_cell = np.cumsum(kept, dtype=self.id_dtype) - 1
+
+        coordinates = self.coordinates(cells)
+        joined = {key: coordinates[key].astype(frames[0][key].dtype).to_numpy() for key in GRID_KEYS}
+        for frame, ids in zip(frames, frame_ids):
+            keep = kept[ids]
+            rows = row_of_cell[ids[keep]]
+            for column in frame.columns.drop(GRID_KEYS):
+                values = frame[column].to_numpy()
+                if not keep.all():
+                    values = values[keep]
+                if len(rows) < len(cells):
+                    if values.dtype.kind not in "fc":
+                        values = values.astype(np.float64)
+                    output = np.full(len(cells), np.nan, dtype=values.dtype)
+                else:
+                    output = np.empty(len(cells), dtype=values.dtype)
+                output[rows] = values
+                joined[column] = output
+
+        # Keep one block per column rather than consolidating (and copying) them
+        return pd.DataFrame(joined, copy=False)
+
+    def mask(self, dataframe, time=None, latitude=None, longitude=None):
+        """Boolean mask of the rows of a dataframe inside inclusive (first, last) ranges."""
+        month, lat, lon = self.positions(dataframe["time"], dataframe["latitude"], dataframe["longitude"])
+        mask = np.ones(len(dataframe), dtype=bool)
+        for position, axis_slice, length in zip([month, lat, lon], self.slices(time, latitude, longitude), self.shape):
+            start, stop, _ = axis_slice.indices(length)
+            mask &= (position >= start) & (position < stop)
+        return mask
+
+
+class GridCube:
+    """
+    Dataset stored as dense (month, latitude, longitude) arrays, one per column,
+    with a `valid` mask of the cells holding a row.
+    """
+
+    def __init__(self, index, data, valid):
+        self.index = index
+        self.data = data
+        self.valid = valid
+
+    @classmethod
+    def from_frame(cls, dataframe, index=None, columns=None):
+        """
+        Scatter a dataframe with at most one row per grid cell into a cube.
+        Float columns are NaN outside of the valid cells, other columns are zero.
+        """
+        index = GridIndex.from_frames([dataframe]) if index is None else index
+        columns = [column for column in dataframe.columns if column not in GRID_KEYS] if columns is None else columns
+        ids = index.frame_cell_ids(dataframe)
+        if (ids < 0).any():
+            raise ValueError(f"Rows outside of {index}")
+
+        valid = np.zeros(index.size, dtype=bool)
+        valid[ids] = True
+        data = {}
+        for column in columns:
+            values = dataframe[column].to_numpy()
+            fill = np.nan if values.dtype.kind in "fc" else 0
+            data[column] = np.full(index.size, fill, dtype=values.dtype)
+            data[column][ids] = values
+            data[column] = data[column].reshape(index.shape)
+        return cls(index, data, valid.reshape(index.shape))
+
+    def point(self, time, latitude, longitude):
+        """Values of a cell as a dict, None if the cell holds no row."""
+        cell = np.unravel_index(self.index.cell_id(time, latitude, longitude), self.index.shape)
+        if not self.valid[cell]:
+            return None
+        return {column: values[cell] for column, values in self.data.items()}
+
+    def select(self, time=None, latitude=None, longitude=None):
+        """Cube over inclusive (first, last) ranges of months, latitudes and longitudes, without copying."""
+        slices = self.index.slices(time, latitude, longitude)
+        return GridCube(
+            self.index.subgrid(time, latitude, longitude),
+            {column: values[slices] for column, values in self.data.items()},
+            self.valid[slices],
+        )
+
+    def to_frame(self):
+        """Rows of the valid cells, in (time, latitude, longitude) order."""
+        cells = np.flatnonzero(self.valid)
+        dataframe = self.index.coordinates(cells)
+        for column, values in self.data.items():
+            dataframe[column] = values.reshape(-1)[cells]
+        return dataframe
+
+    def mean(self, column):
+        """Mean of a column over the valid cells, NaN if there is none."""
+        values = self.data[column][self.valid]
+        return float(np.nanmean(values)) if len(values) else np.nan
@@ -0,0 +1,134 @@
+"""
+Flood risk target labelling from the precipitation indicators.
+
+A row is labelled high risk (1) when enough of its precipitation variables are above their median.
+The medians are fitted once, exactly on in-memory data or approximately in a single
+streaming pass, and can be saved so that new years or chunks are labelled with the
+same thresholds without recomputing global quantiles.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+from data_config import DataConfig
+
+
+def _as_numeric(series):
+    """Values of a column as float64, datetimes as nanoseconds since the epoch."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.astype("datetime64[ns]").astype("int64").to_numpy(dtype=np.float64)
+    return series.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+class QuantileSketch:
+    """
+    Mergeable approximate quantile sketch of bounded size.
+    Values are kept as at most `size` weighted centroids of consecutive ranks,
+    so a quantile is off by about 1 / size in rank.
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        means = np.concatenate([self.means, values])
+        weights = np.concatenate([self.weights, np.ones(len(values))])
+
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        if len(means) > self.size:
+            # Group consecutive ranks into `size` bins of equal total weight
+            cumulative = np.cumsum(weights) - weights
+            bins = np.minimum((cumulative / weights.sum() * self.size).astype(np.int64), self.size - 1)
+            bin_weights = np.bincount(bins, weights=weights, minlength=self.size)
+            bin_sums = np.bincount(bins, weights=means * weights, minlength=self.size)
+            present = bin_weights > 0
+            means, weights = bin_sums[present] / bin_weights[present], bin_weights[present]
+        self.means, self.weights = means, weights
+        return self
+
+    def quantile(self, q):
+        if not len(self.means):
+            return np.nan
+        centers = np.cumsum(self.weights) - self.weights / 2
+        return float(np.interp(q * self.weights.sum(), centers, self.means))
+
+
+class ThresholdLabeller:
+    """
+    Label rows as high flood risk when at least `min_above` of their columns exceed
+    the `quantile` of that column, fitted on the training period.
+
+    By default the columns are the precipitation variables of
+    `DataConfig.EXTREME_PRECIPITATION_VARIABLES` found in the fitted frame;
+    the time and coordinates are never thresholded as if they were variables.
+    `fit` computes the thresholds exactly; `partial_fit` streams over chunks with a
+    `QuantileSketch` per column for data bigger than memory.
+    """
+
+    def __init__(self, quantile=0.5, min_above=4, columns=None, sketch_size=1000):
+        self.quantile = quantile
+        self.min_above = min_above
+        self.columns = columns
+        self.sketch_size = sketch_size
+        self.thresholds_ = None
+        self._sketches = None
+
+    def _columns(self, dataframe):
+        if self.columns is not None:
+            return list(self.columns)
+        return [column for column in DataConfig.EXTREME_PRECIPITATION_VARIABLES if column in dataframe]
+
+    def fit(self, dataframe):
+        """Exact thresholds from an in-memory frame."""
+        self.thresholds_ = {
+            column: float(np.nanquantile(_as_numeric(dataframe[column]), self.quantile))
+            for column in self._columns(dataframe)
+        }
+        return self
+
+    def partial_fit(self, dataframe):
+        """Update approximate thresholds with one more chunk of data."""
+        columns = self._columns(dataframe)
+        if self._sketches is None:
+            self._sketches = {column: QuantileSketch(self.sketch_size) for column in columns}
+        for column in columns:
+            self._sketches[column].update(_as_numeric(dataframe[column]))
+        self.thresholds_ = {column: sketch.quantile(self.quantile) for column, sketch in self._sketches.items()}
+        return self
+
+    def count_above(self, dataframe):
+        """Number of columns above their threshold for each row, missing values never count."""
+        count = np.zeros(len(dataframe), dtype=np.int8)
+        for column, threshold in self.thresholds_.items():
+            count += _as_numeric(dataframe[column]) > threshold
+        return count
+
+    def transform(self, dataframe):
+        """int8 labels: 1 for high flood risk, 0 for low."""
+        return (self.count_above(dataframe) >= self.min_above).astype(np.int8)
+
+    def fit_transform(self, dataframe):
+        return self.fit(dataframe).transform(dataframe)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({
+                "quantile": self.quantile,
+                "min_above": self.min_above,
+                "thresholds": self.thresholds_,
+            }, f, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            content = json.load(f)
+        labeller = cls(quantile=content["quantile"], min_above=content["min_above"],
+                       columns=list(content["thresholds"]))
+        labeller.thresholds_ = content["thresholds"]
+        return labeller
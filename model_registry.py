@@ -0,0 +1,155 @@
+"""
+Registry of the models trained by the experiment scripts.
+
+A model and its scaler are saved together as one joblib artifact, `data/models/<name>-<key>.joblib`,
+with a JSON sidecar describing it. The key hashes the files the training data is read from,
+the features and the parameters of the estimators, so changing any of them trains a new model
+instead of silently reusing a stale one. Data files are fingerprinted with the memoized content
+hashes of the build cache: on an unchanged dataset only their size and mtime are looked at, so
+a script can find its model without loading the training data at all. Artifacts are written
+uncompressed, which lets joblib memory-map their arrays on loading.
+
+Usage:
+    python model_registry.py list
+    python model_registry.py remove NAME
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import joblib
+
+from build_cache import BuildCache
+from data_config import DataConfig
+from data_store import store_path
+from feature_store import META_FILE, features_exist, features_path
+
+
+def models_path(root=None):
+    """Directory holding the registered models, `data/models` by default."""
+    root = DataConfig.DATA_PATH if root is None else Path(root)
+    return root / "models"
+
+
+def dataset_files(name, columns=None, csv_file=None, root=None):
+    """
+    Files a dataset is read from, as the experiments read it: the arrays of the requested columns
+    in the feature store, else the Parquet files of the store, else the legacy CSV export.
+    """
+    if features_exist(name, root):
+        dataset_path = features_path(root) / name
+        with open(dataset_path / META_FILE) as f:
+            files = {column["name"]: column["file"] for column in json.load(f)["columns"]}
+        missing = [column for column in columns or [] if column not in files]
+        if missing:
+            raise KeyError(f"Columns {missing} not in the feature store dataset {name}")
+        return [dataset_path / files[column] for column in (columns or files)]
+    if (store_path(root) / name).exists():
+        return sorted((store_path(root) / name).rglob("*.parquet"))
+    if csv_file is not None and Path(csv_file).exists():
+        return [Path(csv_file)]
+    raise FileNotFoundError(f"{name} not found in the feature store, the store or as a CSV file")
+
+
+def data_fingerprint(datasets, root=None):
+    """
+    Fingerprint of the training data, from `(name, columns, csv_file)` descriptions of the datasets.
+    Only the requested columns count when the data comes from the feature store.
+    """
+    cache = BuildCache(root, enabled=True)
+    return BuildCache.key({
+        name: [cache.file_hash(path) for path in dataset_files(name, columns, csv_file, root)]
+        for name, columns, csv_file in datasets
+    })
+
+
+class ModelRegistry:
+    """Trained models keyed on their data, features and hyperparameters."""
+
+    def __init__(self, root=None):
+        self.path = models_path(root)
+
+    @staticmethod
+    def key(data, features, estimators, params=None):
+        """
+        Key of a model trained on data of fingerprint `data` with the given features and
+        `estimators`, a dict of the unfitted estimators (e.g. model and scaler).
+        `params` holds any other setting of the training, such as the test split.
+        """
+        return BuildCache.key({
+            "data": data,
+            "features": list(features),
+            "params": params,
+            "estimators": {
+                role: {"class": f"{type(estimator).__module__}.{type(estimator).__qualname__}",
+                       "params": repr(sorted(estimator.get_params(deep=True).items()))}
+                for role, estimator in estimators.items()
+            },
+        })
+
+    def _artifact_file(self, name, key):
+        return self.path / f"{name}-{key[:16]}.joblib"
+
+    def load(self, name, key, mmap_mode="r"):
+        """The registered dict of fitted estimators, or None if no model was trained for this key."""
+        artifact_file = self._artifact_file(name, key)
+        if not artifact_file.exists():
+            return None
+        return joblib.load(artifact_file, mmap_mode=mmap_mode)
+
+    def save(self, name, key, estimators, **metadata):
+        """Register a dict of fitted estimators, with optional metadata such as their scores."""
+        artifact_file = self._artifact_file(name, key)
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp_file = artifact_file.with_suffix(".tmp")
+        joblib.dump(estimators, tmp_file)
+        os.replace(tmp_file, artifact_file)
+        with open(artifact_file.with_suffix(".json"), "w") as f:
+            json.dump({
+                "name": name,
+                "key": key,
+                "estimators": {role: type(estimator).__name__ for role, estimator in estimators.items()},
+                "size": artifact_file.stat().st_size,
+                "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                **metadata,
+            }, f, indent=1, default=str)
+
+    def entries(self, name=None):
+        """Sidecars of the registered models, optionally of a single name."""
+        for sidecar in sorted(self.path.glob("*.json")):
+            with open(sidecar) as f:
+                entry = json.load(f)
+            if name is None or entry["name"] == name:
+                yield entry
+
+    def remove(self, name):
+        """Remove every model registered under a name. Returns their count."""
+        removed = list(self.entries(name))
+        for entry in removed:
+            artifact_file = self._artifact_file(entry["name"], entry["key"])
+            artifact_file.unlink(missing_ok=True)
+            artifact_file.with_suffix(".json").unlink(missing_ok=True)
+        return len(removed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the registered models.")
+    parser.add_argument("--root", default=None, help="Data directory (defaults to DataConfig.DATA_PATH).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="List the registered models.")
+    remove_parser = subparsers.add_parser("remove", help="Remove the models registered under a name.")
+    remove_parser.add_argument("name")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.root)
+    if args.command == "list":
+        for entry in registry.entries():
+            print(f"{entry['name']:<16} {entry['key'][:16]} {entry['size'] / 1024 ** 2:>8.2f} MB {entry['created']}")
+    elif args.command == "remove":
+        print(f"Removed {registry.remove(args.name)} model(s).")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,17 @@
+import sys
+
 import rampwf as rw
 
 import pandas as pd
 from pathlib import Path
 
-from sklearn.model_selection import StratifiedShuffleSplit
+# rampwf imports this file from its source, the modules of the kit are found next to it
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from blocked_cv import default_cv
+from cv_runner import saved_folds
+from data_store import read_dataset
+from feature_store import features_exist, load_features
 
 problem_title = 'Template RAMP kit to create data challenges'
 
@@ -24,17 +32,22 @@ score_types = [
 
 
 def get_cv(X, y):
-    cv = StratifiedShuffleSplit(n_splits=5, test_size=0.2)
-    return cv.split(X, y)
+    # Folds of whole (year, tile) blocks, saved to data/folds so that every run and submission uses the same folds
+    return saved_folds(default_cv(), X, y)
 
 
 def load_data(path='.', file='X_train.csv'):
     path = Path(path) / "data"
-    X_df = pd.read_csv(path / file)
+    name = Path(file).stem
+    # Memory-mapped feature store first (zero-copy), then the columnar store or the CSV export
+    if features_exist(name, root=path):
+        X_df = load_features(name, root=path)
+    else:
+        X_df = read_dataset(name, root=path, csv_file=path / file)
 
     y = X_df['target']
     # map target to integer if not already
-    if y.dtype == 'object':
+    if not pd.api.types.is_numeric_dtype(y):
         y = y.map({'high': 1, 'low': 0})
     X_df = X_df.drop(columns=['target'])
 
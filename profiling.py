@@ -0,0 +1,205 @@
+"""
+Lightweight instrumentation of the data pipeline and the experiments.
+
+Named stages are timed with the `stage` context manager or the `profiled` decorator. Each stage
+records its wall time, CPU time, RSS delta, growth of the peak RSS and the rows going in and out,
+and the records can be dumped as a JSON or CSV trace. With detailed profiling enabled
+(`--profile`), the top-level stages also run under cProfile and tracemalloc, and the profile
+and allocation snapshot of the slowest one are written next to the trace.
+
+    with stage("join_on_grid", rows_in=n) as record:
+        joined = ...
+        record.rows_out = len(joined)
+
+Stages run in worker processes (`DataConfig.EXECUTOR == "process"`) or in worker threads
+(the Dask graph of `DataConfig.LAZY_LOADING`) are not recorded.
+"""
+import cProfile
+import csv
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+import psutil
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from data_config import DataConfig
+
+
+def _rss_mb():
+    return psutil.Process(os.getpid()).memory_info().rss / 1024 ** 2
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _rows(value):
+    """Number of rows of a dataframe or array, None for anything else."""
+    return len(value) if getattr(value, "ndim", 0) else None
+
+
+class StageRecord:
+    def __init__(self, name, depth, rows_in=None):
+        self.name = name
+        self.depth = depth
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.wall_s = None
+        self.cpu_s = None
+        self.rss_mb = None
+        self.rss_delta_mb = None
+        self.peak_rss_delta_mb = None
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __str__(self):
+        rows = "".join(f", {count} rows {direction}" for count, direction in [(self.rows_in, "in"), (self.rows_out, "out")]
+                       if count is not None)
+        return (f"[{self.name}] {self.wall_s:.2f}s wall, {self.cpu_s:.2f}s CPU, "
+                f"RSS {self.rss_mb:.0f} MB ({self.rss_delta_mb:+.1f}){rows}")
+
+
+class Profiler:
+    """
+    Collects the records of the stages run in this process.
+
+    - `print_depth`: stages nested at most this deep print their record when they end
+      (0: top-level stages only, None: silent).
+    - `detailed`: run the top-level stages under cProfile and tracemalloc, keeping the
+      profile and allocation snapshot of the slowest one.
+    """
+
+    def __init__(self, print_depth=0, detailed=False):
+        self.print_depth = print_depth
+        self.detailed = detailed
+        self.records = []
+        self._depth = 0
+        self._slowest = None
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        record = StageRecord(name, self._depth, rows_in)
+        if threading.current_thread() is not threading.main_thread():
+            # The stage nesting is tracked for the main thread only
+            yield record
+            return
+        detailed = self.detailed and self._depth == 0
+        if detailed:
+            profile = cProfile.Profile()
+            tracemalloc.start()
+            snapshot_before = tracemalloc.take_snapshot()
+            profile.enable()
+
+        rss, peak_rss = _rss_mb(), _peak_rss_mb()
+        wall, cpu = time.perf_counter(), time.process_time()
+        self._depth += 1
+        try:
+            yield record
+        finally:
+            self._depth -= 1
+            record.wall_s = time.perf_counter() - wall
+            record.cpu_s = time.process_time() - cpu
+            record.rss_mb = _rss_mb()
+            record.rss_delta_mb = record.rss_mb - rss
+            if peak_rss is not None:
+                record.peak_rss_delta_mb = _peak_rss_mb() - peak_rss
+            if detailed:
+                profile.disable()
+                allocations = tracemalloc.take_snapshot().compare_to(snapshot_before, "lineno")
+                tracemalloc.stop()
+                if self._slowest is None or record.wall_s > self._slowest[0].wall_s:
+                    self._slowest = (record, profile, allocations)
+            self.records.append(record)
+            if self.print_depth is not None and record.depth <= self.print_depth:
+                print(record, flush=True)
+
+    def profiled(self, name=None):
+        """Decorator running a function as a stage; rows are counted on its first argument and its result."""
+        def decorator(function):
+            stage_name = name or function.__qualname__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage_name, rows_in=_rows(args[0]) if args else None) as record:
+                    result = function(*args, **kwargs)
+                    record.rows_out = _rows(result)
+                    return result
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """Totals per stage name, slowest first."""
+        import pandas as pd
+
+        if not self.records:
+            return pd.DataFrame()
+        records = pd.DataFrame([record.as_dict() for record in self.records])
+        summary = records.groupby("name").agg(
+            calls=("wall_s", "size"),
+            wall_s=("wall_s", "sum"),
+            cpu_s=("cpu_s", "sum"),
+            rss_delta_mb=("rss_delta_mb", "sum"),
+            peak_rss_delta_mb=("peak_rss_delta_mb", "sum"),
+            rows_out=("rows_out", "sum"),
+        )
+        return summary.sort_values("wall_s", ascending=False)
+
+    def dump(self, path):
+        """Write the records, in completion order, to a `.json` or `.csv` trace."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        records = [record.as_dict() for record in self.records]
+        if path.suffix == ".csv":
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(StageRecord("", 0).as_dict()))
+                writer.writeheader()
+                writer.writerows(records)
+        else:
+            with open(path, "w") as f:
+                json.dump(records, f, indent=1)
+
+    def dump_slowest(self, directory, top=25):
+        """
+        Write the cProfile stats (`.prof`, readable with pstats or snakeviz) and the top
+        allocations of the slowest top-level stage. Returns the stage's name, None if
+        detailed profiling was off.
+        """
+        if self._slowest is None:
+            return None
+        record, profile, allocations = self._slowest
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        file_name = record.name.replace("/", "_").replace(" ", "_")
+        profile.dump_stats(directory / f"{file_name}.prof")
+        with open(directory / f"{file_name}_allocations.txt", "w") as f:
+            f.write(f"Top {top} allocations of stage {record.name} ({record.wall_s:.2f}s):\n")
+            for statistic in allocations[:top]:
+                f.write(f"{statistic}\n")
+        return record.name
+
+    def write_reports(self, prefix, directory=None):
+        """Dump the JSON and CSV traces, and the slowest stage's profile if any, to `data/profile`."""
+        directory = Path(directory or DataConfig.DATA_PATH / "profile")
+        self.dump(directory / f"{prefix}_trace.json")
+        self.dump(directory / f"{prefix}_trace.csv")
+        slowest = self.dump_slowest(directory)
+        print(f"Profiling trace written to {directory}" + (f", slowest stage: {slowest}" if slowest else ""))
+
+
+PROFILER = Profiler()
+stage = PROFILER.stage
+profiled = PROFILER.profiled
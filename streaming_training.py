@@ -0,0 +1,122 @@
+"""
+Out-of-core training of the experiment models.
+
+The training set is read from the store in chunks of `DataConfig.TRAINING_CHUNK_ROWS` rows, so
+memory is bounded by the chunk size rather than by the number of years and cells. Each chunk
+takes a slice of every year partition, so that no chunk is biased towards a single year:
+- a first pass fits the `StandardScaler` with `partial_fit` and collects the classes of the target;
+- a second pass trains the model on the scaled chunks. Estimators with `partial_fit` (e.g.
+  `SGDClassifier`, `GaussianNB`) are updated chunk by chunk; forests are grown with `warm_start`,
+  each chunk fitting its share of the trees, so every tree only sees the rows of one chunk.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from data_config import DataConfig
+from data_store import iter_dataset
+
+
+def iter_training_chunks(name, columns, csv_file=None, chunk_rows=None):
+    """
+    Chunks of a training dataset of the store, each spanning all of its years, falling back
+    to its legacy CSV export (read in file order).
+    """
+    yield from iter_dataset(name, columns=columns, csv_file=csv_file,
+                            batch_rows=chunk_rows or DataConfig.TRAINING_CHUNK_ROWS, interleave=True)
+
+
+def fit_scaler(scaler, chunks, features, target="target"):
+    """
+    First pass: fit the scaler one chunk at a time. `chunks` is a callable returning
+    a fresh iterator over the training set. Returns the sorted classes of the target
+    and the number of chunks.
+    """
+    classes = set()
+    n_chunks = 0
+    for chunk in chunks():
+        scaler.partial_fit(chunk[features])
+        classes.update(chunk[target].unique())
+        n_chunks += 1
+    return np.array(sorted(classes)), n_chunks
+
+
+def fit_model(model, scaler, chunks, features, classes, n_chunks, target="target", epochs=1):
+    """
+    Second pass: train the model on the scaled chunks, `epochs` times over the training set
+    for estimators with `partial_fit`. Forests keep their number of trees, spread over the chunks.
+    """
+    if hasattr(model, "partial_fit"):
+        for _ in range(epochs):
+            for chunk in chunks():
+                model.partial_fit(scaler.transform(chunk[features]), chunk[target], classes=classes)
+        return model
+    if "warm_start" in model.get_params() and "n_estimators" in model.get_params():
+        return _grow_forest(model, scaler, chunks, features, classes, n_chunks, target)
+    raise ValueError(f"{type(model).__name__} can neither be trained with partial_fit nor grown with warm_start")
+
+
+def _grow_forest(model, scaler, chunks, features, classes, n_chunks, target):
+    """
+    Grow the `n_estimators` trees of a forest with `warm_start`. Each fit gets a share of the
+    trees left in proportion to its number of chunks, keeping at least one tree for each fit to
+    come. With more chunks than trees, consecutive chunks are fitted together so that all the
+    data is used. Every tree must see every class, or the forest cannot average their
+    probabilities: chunks missing one are carried on to the next fit, and rows left at the end
+    are fitted with the remaining trees, along with the previous fit's rows if they miss a class.
+    """
+    n_estimators = model.n_estimators
+    chunks_per_fit = math.ceil(n_chunks / n_estimators)
+    warm_start = model.warm_start
+    model.set_params(warm_start=True)
+
+    def has_classes(sample):
+        return len(np.intersect1d(sample[target].unique(), classes)) == len(classes)
+
+    def grow(sample, trees):
+        model.set_params(n_estimators=len(getattr(model, "estimators_", [])) + trees)
+        model.fit(scaler.transform(sample[features]), sample[target])
+
+    grown = 0
+    fitted_chunks = 0
+    pending = []
+    sample = None
+    for chunk in chunks():
+        pending.append(chunk)
+        if len(pending) < chunks_per_fit:
+            continue
+        candidate = pd.concat(pending) if len(pending) > 1 else chunk
+        if not has_classes(candidate):
+            continue
+        sample = candidate
+        remaining_chunks = max(n_chunks - fitted_chunks, len(pending))
+        later_fits = math.ceil((remaining_chunks - len(pending)) / chunks_per_fit)
+        trees = min(max(1, (n_estimators - grown) * len(pending) // remaining_chunks),
+                    n_estimators - grown - later_fits)
+        grow(sample, trees)
+        grown += trees
+        fitted_chunks += len(pending)
+        pending = []
+
+    if pending:
+        candidate = pd.concat(pending)
+        if not has_classes(candidate):
+            candidate = pd.concat([sample, candidate])
+        grow(candidate, n_estimators - grown)
+    elif grown < n_estimators:
+        grow(sample, n_estimators - grown)
+
+    if len(model.estimators_) != n_estimators:
+        raise RuntimeError(f"{len(model.estimators_)} trees grown, {n_estimators} asked")
+    model.set_params(warm_start=warm_start)
+    return model
+
+
+def predict_chunks(model, scaler, chunks, features, target="target"):
+    """True and predicted targets of a dataset, predicted one chunk at a time."""
+    y_true, y_pred = [], []
+    for chunk in chunks:
+        y_true.append(chunk[target].to_numpy())
+        y_pred.append(model.predict(scaler.transform(chunk[features])))
+    return np.concatenate(y_true), np.concatenate(y_pred)
@@ -5,38 +5,33 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.base import BaseEstimator, TransformerMixin
 import numpy as np
-import pandas as pd
-from tqdm import tqdm
 
 
 
 class Preprocessor(BaseEstimator, TransformerMixin):
+    """
+    Select the coordinates, precipitation and air temperature and standardize them
+    with the means and standard deviations learned in `fit`, so that train and test
+    batches are scaled the same way. Returns a float32 array.
+    """
+    columns = ['latitude', 'longitude', 'precipitation', 'air_temperature']
+
     def fit(self, X, y=None):
-        return self 
-    
+        values = X[self.columns].to_numpy(dtype=np.float64)
+        self.mean_ = np.nanmean(values, axis=0)
+        self.scale_ = np.nanstd(values, axis=0, ddof=1)
+        # Leave constant columns unscaled rather than dividing by zero
+        self.scale_[self.scale_ == 0] = 1.0
+        return self
 
     def transform(self, X):
-        features = []
-        for i in tqdm(X.index):
-            lat,lon=X.loc[i, 'latitude'],X.loc[i, 'longitude']
-            precipitation = X.loc[i, 'precipitation']
-            air_temp = X.loc[i, 'air_temperature']
-            features.append(np.concatenate([[lat], [lon], [precipitation], [air_temp]]))
-
-        df = pd.DataFrame(np.array(features), columns=['lat', 'lon', 'precipitation', 'air_temperature'])
-
-        #normalize lat and lon
-        df['lat'] = (df['lat'] - df['lat'].mean()) / df['lat'].std()
-        df['lon'] = (df['lon'] - df['lon'].mean()) / df['lon'].std()
-        #normalize precipitation and air_temperature
-        df['precipitation'] = (df['precipitation'] - df['precipitation'].mean()) / df['precipitation'].std()
-        df['air_temperature'] = (df['air_temperature'] - df['air_temperature'].mean()) / df['air_temperature'].std()
-        df = df.astype(float)
-        
-        print("Preprocessing completed.")
-        return df
-    
-    
+        # A single float32 copy of the selected columns, then standardized in place
+        features = X[self.columns].to_numpy(dtype=np.float32)
+        features -= self.mean_.astype(np.float32)
+        features /= self.scale_.astype(np.float32)
+        return features
+
+
 def get_estimator():
     pipe = make_pipeline(
         Preprocessor(),
@@ -0,0 +1,100 @@
+from sklearn.pipeline import make_pipeline
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.base import BaseEstimator, ClassifierMixin, TransformerMixin
+from threadpoolctl import threadpool_limits
+import numpy as np
+
+# Code of the missing values, after the bins
+MISSING_BIN = 255
+
+
+class QuantileBinner(BaseEstimator, TransformerMixin):
+    """
+    Select the coordinates, precipitation and air temperature and replace each value by the
+    index of its quantile bin, with the bin edges learned in `fit` on at most `subsample` rows.
+    Returns a uint8 array, an eighth of the float64 features. Missing values get `MISSING_BIN`,
+    which `BinnedHistGradientBoosting` hands to the model as missing. The 255 bins at most fit
+    in the 255 bins of `HistGradientBoostingClassifier`, which keeps them as they are.
+    """
+    columns = ['latitude', 'longitude', 'precipitation', 'air_temperature']
+
+    def __init__(self, n_bins=255, subsample=200_000, random_state=0):
+        self.n_bins = n_bins
+        self.subsample = subsample
+        self.random_state = random_state
+
+    def fit(self, X, y=None):
+        if not 2 <= self.n_bins <= MISSING_BIN:
+            raise ValueError(f"n_bins must be between 2 and {MISSING_BIN}, got {self.n_bins}")
+        values = X[self.columns].to_numpy(dtype=np.float64)
+        if self.subsample is not None and len(values) > self.subsample:
+            rows = np.random.default_rng(self.random_state).choice(len(values), self.subsample, replace=False)
+            values = values[rows]
+        # Inner edges only: values below the first edge go to bin 0, above the last to bin n_bins - 1
+        quantiles = np.linspace(0, 1, self.n_bins + 1)[1:-1]
+        self.bin_edges_ = [np.unique(np.nanquantile(column, quantiles)) for column in values.T]
+        return self
+
+    def transform(self, X):
+        binned = np.empty((len(X), len(self.columns)), dtype=np.uint8)
+        for i, (column, edges) in enumerate(zip(self.columns, self.bin_edges_)):
+            values = X[column].to_numpy()
+            binned[:, i] = np.searchsorted(edges, values, side='right')
+            binned[np.isnan(values), i] = MISSING_BIN
+        return binned
+
+
+def _with_missing(X):
+    """
+    Binned features with `MISSING_BIN` replaced by NaN, so that the model handles them as missing
+    values rather than as the highest bin. Matrices without missing values are kept as uint8.
+    """
+    missing = X == MISSING_BIN
+    if not missing.any():
+        return X
+    X = X.astype(np.float32)
+    X[missing] = np.nan
+    return X
+
+
+class BinnedHistGradientBoosting(ClassifierMixin, BaseEstimator):
+    """
+    Histogram gradient boosting on binned features, fitted and predicting on
+    `n_threads` OpenMP threads (all cores if None).
+    """
+
+    def __init__(self, max_iter=200, learning_rate=0.1, max_leaf_nodes=31, n_threads=None, random_state=0):
+        self.max_iter = max_iter
+        self.learning_rate = learning_rate
+        self.max_leaf_nodes = max_leaf_nodes
+        self.n_threads = n_threads
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        self.model_ = HistGradientBoostingClassifier(
+            max_iter=self.max_iter,
+            learning_rate=self.learning_rate,
+            max_leaf_nodes=self.max_leaf_nodes,
+            random_state=self.random_state,
+        )
+        with threadpool_limits(limits=self.n_threads, user_api='openmp'):
+            self.model_.fit(_with_missing(X), y)
+        self.classes_ = self.model_.classes_
+        return self
+
+    def predict(self, X):
+        with threadpool_limits(limits=self.n_threads, user_api='openmp'):
+            return self.model_.predict(_with_missing(X))
+
+    def predict_proba(self, X):
+        with threadpool_limits(limits=self.n_threads, user_api='openmp'):
+            return self.model_.predict_proba(_with_missing(X))
+
+
+def get_estimator():
+    pipe = make_pipeline(
+        QuantileBinner(),
+        BinnedHistGradientBoosting()
+    )
+
+    return pipe